@@ -0,0 +1,361 @@
+"""Benchmarks of the ledger hot paths on synthetic budget databases.
+
+python benchmark.py --rows 10000,100000 --out results.json
+python benchmark.py --rows 10000,100000 --baseline results.json
+
+Synthetic ledgers are generated once per size and seed into --cache-dir and
+copied for each run, so every run starts from the same database. Each case is timed --repeat times (the best run is
+reported) and run once more under tracemalloc for its peak Python memory.
+The GUI cases drive TransactionEntryApp on the offscreen Qt platform and
+are skipped when PyQt5 is not installed. With --baseline, cases that got
+more than --threshold slower are listed and the exit status is 1.
+"""
+import sys
+import os
+import csv
+import json
+import time
+import random
+import shutil
+import argparse
+import datetime
+import platform
+import tempfile
+import itertools
+import sqlite3
+import tracemalloc
+
+from ledger import (
+    DEFAULT_SUBCATEGORIES, DEFAULT_SUBSUBCATEGORIES, Ledger, create_schema, import_rows, export_rows
+)
+
+# Ledger sizes benchmarked when --rows is not given
+DEFAULT_SIZES = (10000, 100000)
+
+# Cases that read every matching row into memory are skipped above this size
+FULL_READ_LIMIT = 1000000
+
+FUNDS = ['Dinheiro', 'Conta Bancária 1', 'Conta Bancária 2', 'Conta Bancária 3', 'Conta Bancária 4',
+         'Conta Bancária 5']
+SUPPLIER_SYLLABLES = ['pin', 'go', 'do', 'ce', 'con', 'ti', 'nen', 'te', 'gal', 'lid', 'al', 'fa', 'ma',
+                      'cia', 'ra', 'bo', 'ver', 'de', 'sol', 'mar', 'lu', 'z', 'cas', 'tro']
+
+
+def category_paths():
+    """Every (category, subcategory, subsubcategory) of the default taxonomy"""
+    paths = []
+    for category, subcategories in DEFAULT_SUBCATEGORIES.items():
+        for subcategory in subcategories:
+            subsubcategories = [name for name in DEFAULT_SUBSUBCATEGORIES.get(subcategory, []) if name != 'Outra']
+            for subsubcategory in subsubcategories or ['N/A']:
+                paths.append((category, subcategory, subsubcategory))
+    return paths
+
+
+def zipf_weights(count, rng):
+    """Cumulative Zipf weights over count items in a seeded random order"""
+    ranks = list(range(1, count + 1))
+    rng.shuffle(ranks)
+    return list(itertools.accumulate(1.0 / rank for rank in ranks))
+
+
+def synthetic_rows(count, seed=0, start=datetime.date(2015, 1, 1), days=3650, batch_size=10000):
+    """Yield count Transactions tuples with a realistic shape.
+
+    Category paths and the suppliers filed under each follow Zipf
+    frequencies, so a few dominate as in a real ledger; about one row in
+    twenty is income. Dates rise with the row number across the span.
+    """
+    rng = random.Random(seed)
+    paths = category_paths()
+    path_weights = zipf_weights(len(paths), rng)
+    suppliers = {}
+    for path in paths:
+        names = [' '.join(''.join(rng.choice(SUPPLIER_SYLLABLES) for _ in range(rng.randint(2, 4))).title()
+                          for _ in range(rng.randint(1, 2)))
+                 for _ in range(rng.randint(1, 8))]
+        suppliers[path] = (names, zipf_weights(len(names), rng))
+    income = [path for path in paths if path[0] == 'Receitas']
+    done = 0
+    while done < count:
+        size = min(batch_size, count - done)
+        for i, path in enumerate(rng.choices(paths, cum_weights=path_weights, k=size)):
+            if rng.random() < 0.05:
+                path = rng.choice(income)
+            names, weights = suppliers[path]
+            supplier = rng.choices(names, cum_weights=weights)[0]
+            is_income = path[0] == 'Receitas'
+            value = round(rng.lognormvariate(7.0 if is_income else 3.5, 0.8), 2)
+            date = start + datetime.timedelta(days=(done + i) * days // count)
+            yield (date.isoformat(), value, 'Crédito' if is_income else 'Débito', supplier,
+                   rng.choice(FUNDS)) + path
+        done += size
+
+
+def generate_ledger(path, rows, seed=0):
+    """Write a synthetic budget database of the given size"""
+    db = sqlite3.connect(path)
+    try:
+        create_schema(db)
+        import_rows(db, synthetic_rows(rows, seed))
+    finally:
+        db.close()
+
+
+def cached_ledger(cache_dir, rows, seed=0):
+    """Path of a synthetic database of the given size, generating it on first use"""
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, f"ledger_{rows}_{seed}.db")
+    if not os.path.exists(path):
+        print(f"Generating {rows} rows into {path}...")
+        start = time.perf_counter()
+        generate_ledger(path + '.tmp', rows, seed)
+        os.replace(path + '.tmp', path)
+        print(f"Generated in {time.perf_counter() - start:.1f}s")
+    return path
+
+
+class Case:
+    """One timed operation; run() returns the number of rows it read, wrote or shows"""
+
+    def __init__(self, name, run, cleanup=None):
+        self.name = name
+        self.run = run
+        self.cleanup = cleanup
+
+    def measure(self, repeat):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            rows = self.run()
+            seconds = time.perf_counter() - start
+            if self.cleanup is not None:
+                self.cleanup()
+            best = seconds if best is None else min(best, seconds)
+        tracemalloc.start()
+        self.run()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        if self.cleanup is not None:
+            self.cleanup()
+        return {
+            'case': self.name,
+            'seconds': round(best, 6),
+            'peak_kb': peak // 1024,
+            'rows': rows,
+            'rows_per_s': round(rows / best) if best > 0 else None,
+        }
+
+
+def ledger_cases(ledger, rows, workdir):
+    """Headless cases run against the Ledger API"""
+    cases = []
+
+    def query(filters, date_range=None, limit=None):
+        def run():
+            where, params = ledger.filter_clause(filters, date_range)
+            return len(ledger.query(where, params, limit))
+        return run
+
+    def total(filters):
+        def run():
+            ledger.total(*ledger.filter_clause(filters))
+            return 1
+        return run
+
+    def filters(**columns):
+        return [columns.get(name, '') for name in ('date', 'value', 'type', 'supplier', 'funds', 'category',
+                                                   'subcategory', 'subsubcategory')]
+
+    def undo(count):
+        # Through the ledger, so the columnar cache loses the rows too
+        def cleanup():
+            for _ in range(count):
+                ledger.undo()
+        return cleanup
+
+    def add():
+        for i in range(100):
+            ledger.add(('2025-01-01', 10.0 + i, 'Débito', 'Benchmark', 'Dinheiro', 'Lazer', 'Hobbies', 'N/A'))
+        return 100
+
+    import_path = os.path.join(workdir, 'import.csv')
+    with open(import_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['date', 'value', 'type', 'supplier', 'funds', 'category', 'subcategory',
+                         'subsubcategory'])
+        writer.writerows(synthetic_rows(10000, seed=1))
+    export_path = os.path.join(workdir, 'export.csv')
+
+    cases.append(Case('load_page', query(filters(), limit=500)))
+    if rows <= FULL_READ_LIMIT:
+        cases.append(Case('load_all', query(filters())))
+        cases.append(Case('export_csv', lambda: export_rows(ledger.db, export_path)))
+    cases.append(Case('filter_supplier', query(filters(supplier='pin'))))
+    cases.append(Case('filter_category', query(filters(category='lazer'))))
+    cases.append(Case('filter_date_range', query(filters(), ('2020-01-01', '2020-12-31'))))
+    cases.append(Case('total_unfiltered', total(filters())))
+    cases.append(Case('total_filtered', total(filters(funds='dinheiro'))))
+    cases.append(Case('summary_month_category', lambda: len(ledger.summary(('month', 'category')))))
+    cases.append(Case('summary_funds', lambda: len(ledger.summary(('funds',)))))
+    # The columnar cache holds the whole table, so it is measured where load_all is
+    columns = ledger.columns() if rows <= FULL_READ_LIMIT else None
+    if columns is not None:
+        def columns_total(filters, date_range=None):
+            def run():
+                columns.total(columns.mask(filters, date_range))
+                return 1
+            return run
+
+        cases.append(Case('columns_load', lambda: type(columns).load(ledger.db).size))
+        cases.append(Case('columns_total_unfiltered', columns_total(filters())))
+        cases.append(Case('columns_total_filtered', columns_total(filters(funds='dinheiro'))))
+        cases.append(Case('columns_total_supplier', columns_total(filters(supplier='pin'))))
+        cases.append(Case('columns_total_date_range', columns_total(filters(), ('2020-01-01', '2020-12-31'))))
+        cases.append(Case('columns_month_category', lambda: len(columns.monthly_category_totals())))
+    cases.append(Case('add', add, undo(100)))
+    cases.append(Case('import_10k', lambda: ledger.import_csv(import_path)[0], undo(1)))
+    return cases
+
+
+def gui_cases(db_path):
+    """Cases that drive the Qt window headlessly; empty without PyQt5"""
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    try:
+        from PyQt5.QtWidgets import QApplication
+        import main
+    except ImportError as e:
+        print(f"Skipping GUI cases: {e}")
+        return []
+    app = QApplication.instance() or QApplication([])
+
+    class BenchmarkApp(main.TransactionEntryApp):
+        def get_db_path(self):
+            return db_path
+
+    def settle(window):
+        while window.filter_task is not None:
+            app.processEvents()
+            time.sleep(0.001)
+        app.processEvents()
+
+    window = None
+
+    def start():
+        nonlocal window
+        if window is not None:
+            window.close()
+        window = BenchmarkApp()
+        settle(window)
+        return window.model.rowCount()
+
+    def build_chart():
+        window.build_chart()
+        window.graph_canvas.draw()
+        return len(window.monthly_data)
+
+    def search(text):
+        def run():
+            window.search_boxes[3].setText(text)
+            window.apply_filter()
+            settle(window)
+            return window.model.rowCount()
+        return run
+
+    def reset():
+        window.reset_search()
+        settle(window)
+
+    def submit():
+        for i in range(20):
+            window.le_value.setText(str(10 + i))
+            window.le_supplier.setText('Benchmark')
+            window.submit_data()
+        settle(window)
+        return 20
+
+    def remove_submitted():
+        for _ in range(20):
+            window.undo_last()
+            settle(window)
+
+    start()
+    return [
+        Case('gui_start', start),
+        Case('gui_chart', build_chart),
+        Case('gui_filter', search('pin'), reset),
+        Case('gui_reset', lambda: reset() or window.model.rowCount()),
+        Case('gui_submit', submit, remove_submitted),
+    ]
+
+
+def compare(results, baseline, threshold):
+    """Cases more than threshold (a fraction) slower than in the baseline results"""
+    previous = {(entry['rows_in_db'], entry['case']): entry['seconds'] for entry in baseline['results']}
+    regressions = []
+    for entry in results['results']:
+        before = previous.get((entry['rows_in_db'], entry['case']))
+        if before and entry['seconds'] > before * (1 + threshold):
+            regressions.append((entry['rows_in_db'], entry['case'], before, entry['seconds']))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='benchmark.py')
+    parser.add_argument('--rows', default=','.join(str(size) for size in DEFAULT_SIZES),
+                        help='comma separated ledger sizes, e.g. 10000,100000,1000000,10000000')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--cases', default=None, help='comma separated case names to run (default: all)')
+    parser.add_argument('--no-gui', action='store_true', help='skip the cases that need Qt')
+    parser.add_argument('--cache-dir', default=os.path.join(tempfile.gettempdir(), 'contas_benchmark'))
+    parser.add_argument('--out', default='benchmark_results.json')
+    parser.add_argument('--baseline', default=None, help='results file to compare against')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='slowdown over the baseline reported as a regression (0.2 = 20%%)')
+    args = parser.parse_args(argv)
+    selected = set(args.cases.split(',')) if args.cases else None
+
+    results = {
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'results': [],
+    }
+    for size in (int(size) for size in args.rows.split(',')):
+        with tempfile.TemporaryDirectory() as workdir:
+            # The cases write to the ledger, so they get a copy of the cached one
+            db_path = os.path.join(workdir, f"ledger_{size}.db")
+            shutil.copy(cached_ledger(args.cache_dir, size, args.seed), db_path)
+            ledger = Ledger(db_path)
+            cases = ledger_cases(ledger, size, workdir)
+            if not args.no_gui:
+                cases += gui_cases(db_path)
+            for case in cases:
+                if selected is not None and case.name not in selected:
+                    continue
+                entry = dict(rows_in_db=size, **case.measure(args.repeat))
+                results['results'].append(entry)
+                print(f"{size:>10} {entry['case']:<24} {entry['seconds'] * 1000:10.1f} ms "
+                      f"{entry['peak_kb']:>8} KiB {entry['rows_per_s'] or 0:>12} rows/s")
+            ledger.close()
+
+    with open(args.out, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.out}")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        for size, name, before, after in regressions:
+            print(f"REGRESSION {name} at {size} rows: {before * 1000:.1f} ms -> {after * 1000:.1f} ms")
+        if regressions:
+            return 1
+        print(f"No case more than {args.threshold:.0%} slower than {args.baseline}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,128 @@
+"""Budget targets against actual amounts, and forecasts, per month x category.
+
+Everything is computed on the month x category grid of totals that
+MonthlyTotals keeps, never on individual transactions, so a multi-year
+ledger is a few thousand cells and the whole report is a handful of NumPy
+operations. Ledger.budget_report() keeps the report until the tables
+change.
+
+Forecasts are seasonal moving averages: each category's calendar-month
+seasonal index (with at least SEASONAL_MIN_MONTHS of history) divides the
+amounts out, the trailing mean of the previous `window` deseasonalised
+months gives the level, and the level times the month's index is the
+forecast. Months past the last one with data keep the last level.
+"""
+import numpy as np
+
+# Shorter histories cannot tell a season from noise, so their index stays 1
+SEASONAL_MIN_MONTHS = 24
+
+
+def month_number(month):
+    """'YYYY-MM' -> months since year 0, so consecutive months differ by 1"""
+    return int(month[:4]) * 12 + int(month[5:7]) - 1
+
+
+def month_label(number):
+    return f"{number // 12:04d}-{number % 12 + 1:02d}"
+
+
+class BudgetReport:
+    """Actual, budget, trailing mean and forecast arrays over months x categories.
+
+    totals is month -> category -> amount, as ledger.monthly_category_totals
+    returns it, and targets (category, month) -> amount as
+    ledger.budget_targets does. Months with no transactions between the
+    first and the last are zeros, not gaps; the `horizon` months after the
+    last are forecast only.
+    """
+
+    def __init__(self, totals, targets, window=3, horizon=3):
+        self.window = window
+        months = [month for month in totals if len(month) >= 7 and month[:4].isdigit() and month[5:7].isdigit()]
+        self.categories = sorted({category for month in months for category in totals[month] if category}
+                                 | {category for category, _ in targets})
+        column = {category: i for i, category in enumerate(self.categories)}
+        if months:
+            first = min(month_number(month) for month in months)
+            last = max(month_number(month) for month in months)
+        else:
+            first = last = None
+        self.first = first
+        self.history = 0 if first is None else last - first + 1
+        count = self.history + (horizon if first is not None else 0)
+        self.months = [month_label(first + i) for i in range(count)] if first is not None else []
+
+        self.actual = np.zeros((count, len(self.categories)))
+        for month in months:
+            row = month_number(month) - first
+            for category, amount in totals[month].items():
+                if category:
+                    self.actual[row, column[category]] += amount
+
+        self.budget = np.full((count, len(self.categories)), np.nan)
+        for (category, month), amount in sorted(targets.items(), key=lambda item: item[0][1] != ''):
+            if not month:
+                self.budget[:, column[category]] = amount
+            elif first is not None and 0 <= month_number(month) - first < count:
+                self.budget[month_number(month) - first, column[category]] = amount
+
+        calendar = (np.arange(count) + (first or 0)) % 12
+        self.seasonal = self.seasonal_index(self.actual[:self.history], calendar[:self.history])
+        self.trailing = self.trailing_mean(self.actual[:self.history], count)
+        level = self.trailing_mean(self.actual[:self.history] / self.seasonal[calendar[:self.history]], count)
+        self.forecast = level * self.seasonal[calendar]
+
+    def seasonal_index(self, actual, calendar):
+        """12 x categories: each calendar month's mean over the overall mean, 1 where unknown"""
+        index = np.ones((12, actual.shape[1]))
+        if len(actual) < SEASONAL_MIN_MONTHS:
+            return index
+        sums = np.zeros_like(index)
+        np.add.at(sums, calendar, actual)
+        counts = np.bincount(calendar, minlength=12)[:, None]
+        overall = actual.mean(axis=0)
+        seasonal = np.divide(sums / np.maximum(counts, 1), overall, out=index.copy(), where=overall != 0)
+        # A month that never had an amount would forecast nothing ever again
+        return np.where(seasonal > 0, seasonal, 1.0)
+
+    def trailing_mean(self, history, count):
+        """Mean of the previous `window` months for each month, the last one's held past the history"""
+        means = np.zeros((count, history.shape[1]))
+        if not len(history):
+            return means
+        cumulative = np.vstack([np.zeros(history.shape[1]), np.cumsum(history, axis=0)])
+        ends = np.minimum(np.arange(count), len(history))
+        starts = np.maximum(ends - self.window, 0)
+        spans = (ends - starts)[:, None]
+        np.divide(cumulative[ends] - cumulative[starts], spans, out=means, where=spans > 0)
+        return means
+
+    def rows(self, month):
+        """ledger.BUDGET_REPORT_COLUMNS rows for one 'YYYY-MM' month; None where unknown.
+
+        One row per category, then the total of the budgeted ones.
+        """
+        if month not in self.months:
+            return []
+        row = self.months.index(month)
+        actual = self.actual[row] if row < self.history else np.full(len(self.categories), np.nan)
+        budget = self.budget[row]
+        remaining = budget - actual
+        used = np.divide(actual * 100, budget, out=np.full_like(budget, np.nan), where=budget > 0)
+        table = np.column_stack([budget, actual, remaining, used, self.trailing[row], self.forecast[row]])
+        rows = [(category, *(None if np.isnan(value) else float(value) for value in values))
+                for category, values in zip(self.categories, table)]
+        # Income and spending categories do not add up to anything, so the
+        # total only covers the categories with a budget
+        budgeted = ~np.isnan(budget)
+        if budgeted.any():
+            totals = np.nansum(table[budgeted], axis=0)
+            if row >= self.history:
+                totals[1:4] = np.nan
+            elif totals[0] > 0:
+                totals[3] = totals[1] * 100 / totals[0]
+            else:
+                totals[3] = np.nan
+            rows.append(('Total', *(None if np.isnan(value) else float(value) for value in totals)))
+        return rows
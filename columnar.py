@@ -0,0 +1,197 @@
+"""Columnar in-memory copy of the Transactions table for vectorised totals.
+
+Values are held in float64 arrays. Dates and the text columns are int32
+codes into the distinct labels of each column, so a search box is matched
+once per distinct label and then spread over every row with one array
+lookup. Each row's month and signed amount (credits positive) are worked
+out when it is added, so totals, filter masks and the month x category
+grid of a million rows are a handful of array passes.
+
+The cache is loaded once and kept in step with append() and remove();
+extend() picks up rows written through another connection. It needs
+numpy, which Ledger.columns() only imports when the cache is asked for.
+"""
+import string
+from collections import defaultdict
+
+import numpy as np
+
+from ledger import COLUMN_NAMES, CREDIT_TYPES, ID_INDEX, TAXONOMY_COLUMNS, VOCABULARY_COLUMNS, iter_query_chunks
+
+# Every displayed column but value is stored as codes into its labels
+LABELLED_COLUMNS = tuple(column for column in COLUMN_NAMES if column != 'value')
+
+# SQLite's LIKE only folds the case of ASCII letters
+ASCII_LOWER = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+
+class Labels:
+    """Distinct values of one column and the integer code standing for each"""
+
+    def __init__(self):
+        self.values = []
+        self.codes = {}
+
+    def __len__(self):
+        return len(self.values)
+
+    def code(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def encode(self, values):
+        """int32 codes of a sequence of values, adding the ones not seen before"""
+        for value in set(values).difference(self.codes):
+            self.code(value)
+        return np.fromiter(map(self.codes.__getitem__, values), np.int32, len(values))
+
+    def lookup(self, predicate):
+        """Boolean array indexed by code: which non-NULL labels satisfy predicate"""
+        return np.fromiter((value is not None and predicate(value) for value in self.values), bool, len(self.values))
+
+
+class ColumnarCache:
+    """The Transactions table as NumPy columns, for totals and group-bys without SQL.
+
+    arrays holds one array per row attribute: 'id', 'value' (NaN where
+    NULL), 'signed' (the row's contribution to a total), 'month' (a code
+    into months, -1 without a date) and the codes of each labelled column.
+    They are over-allocated so appending a row is amortised O(1); only the
+    first size entries are rows.
+    """
+
+    def __init__(self):
+        self.size = 0
+        self.arrays = {'id': np.empty(0, np.int64), 'value': np.empty(0, np.float64),
+                       'signed': np.empty(0, np.float64), 'month': np.empty(0, np.int32)}
+        self.arrays.update((column, np.empty(0, np.int32)) for column in LABELLED_COLUMNS)
+        self.labels = {column: Labels() for column in LABELLED_COLUMNS}
+        self.months = Labels()
+        self._date_months = np.empty(0, np.int32)
+        self._type_signs = np.empty(0, np.float64)
+
+    @classmethod
+    def load(cls, db):
+        cache = cls()
+        for rows in iter_query_chunks(db, "", ()):
+            cache.extend(rows)
+        return cache
+
+    def column(self, name):
+        return self.arrays[name][:self.size]
+
+    @property
+    def last_id(self):
+        return int(self.column('id').max()) if self.size else 0
+
+    def _reserve(self, count):
+        needed = self.size + count
+        capacity = len(self.arrays['id'])
+        if needed <= capacity:
+            return
+        capacity = max(needed, 2 * capacity, 1024)
+        for name, array in self.arrays.items():
+            grown = np.empty(capacity, array.dtype)
+            grown[:self.size] = array[:self.size]
+            self.arrays[name] = grown
+
+    def extend(self, rows):
+        """Append rows in SELECT_COLUMNS order, id last"""
+        if not rows:
+            return
+        columns = list(zip(*rows))
+        self._reserve(len(rows))
+        new = slice(self.size, self.size + len(rows))
+        self.arrays['id'][new] = columns[ID_INDEX]
+        # None becomes NaN
+        values = np.array(columns[COLUMN_NAMES.index('value')], dtype=np.float64)
+        self.arrays['value'][new] = values
+        for column in LABELLED_COLUMNS:
+            self.arrays[column][new] = self.labels[column].encode(columns[COLUMN_NAMES.index(column)])
+        self.arrays['month'][new] = self.date_months()[self.arrays['date'][new]]
+        self.arrays['signed'][new] = np.nan_to_num(values) * self.type_signs()[self.arrays['type'][new]]
+        self.size = new.stop
+
+    def append(self, row):
+        self.extend([row])
+
+    def remove(self, ids):
+        """Drop the rows with these ids; returns how many there were"""
+        keep = ~np.isin(self.column('id'), np.fromiter(ids, np.int64))
+        kept = int(keep.sum())
+        removed = self.size - kept
+        if removed:
+            for array in self.arrays.values():
+                array[:kept] = array[:self.size][keep]
+            self.size = kept
+        return removed
+
+    def date_months(self):
+        """Month code of each date label, -1 for the NULL and empty dates"""
+        dates = self.labels['date'].values
+        known = len(self._date_months)
+        if known < len(dates):
+            new = [self.months.code(str(date)[:7]) if date else -1 for date in dates[known:]]
+            self._date_months = np.concatenate([self._date_months, np.array(new, np.int32)])
+        return self._date_months
+
+    def type_signs(self):
+        """+1 for the credit type labels, -1 for the other types, 0 for rows without a type"""
+        types = self.labels['type'].values
+        known = len(self._type_signs)
+        if known < len(types):
+            new = [0.0 if not ttype else 1.0 if str(ttype).lower() in CREDIT_TYPES else -1.0
+                   for ttype in types[known:]]
+            self._type_signs = np.concatenate([self._type_signs, np.array(new, np.float64)])
+        return self._type_signs
+
+    def mask(self, filters, date_range=None, fts=False):
+        """Boolean row mask selecting what build_filter_clause would, or None.
+
+        None means a filter only SQLite can answer exactly: text searches
+        on value, and supplier word searches when FTS is enabled.
+        """
+        mask = np.ones(self.size, bool)
+        if date_range is not None:
+            low, high = date_range
+            lookup = self.labels['date'].lookup(lambda date: isinstance(date, str) and low <= date <= high)
+            mask &= lookup[self.column('date')]
+        for column, text in zip(COLUMN_NAMES, filters):
+            if not text:
+                continue
+            if column == 'value' or column == 'supplier' and fts:
+                return None
+            if column in VOCABULARY_COLUMNS or column in TAXONOMY_COLUMNS:
+                lookup = self.labels[column].lookup(lambda value: text in str(value).lower())
+            else:
+                lookup = self.labels[column].lookup(lambda value: text in str(value).translate(ASCII_LOWER))
+            mask &= lookup[self.column(column)]
+        return mask
+
+    def total(self, mask=None):
+        """Signed sum, credits positive, of all rows or those selected by mask"""
+        signed = self.column('signed')
+        return float(signed.sum() if mask is None else np.dot(signed, mask))
+
+    def monthly_category_totals(self, mask=None):
+        """month -> category -> amount, like ledger.monthly_category_totals, of all rows or those in mask"""
+        categories = self.labels['category'].values
+        # Bins start with one per category for the rows without a month; those
+        # bins, where the unselected and NULL-valued rows are sent too, are dropped.
+        keys = (self.column('month') + 1) * len(categories) + self.column('category')
+        values = self.column('value')
+        excluded = np.isnan(values)
+        if mask is not None:
+            excluded |= ~mask
+        keys[excluded] = 0
+        size = (len(self.months) + 1) * len(categories)
+        sums = np.bincount(keys, weights=values, minlength=size)
+        counts = np.bincount(keys, minlength=size)
+        totals = defaultdict(lambda: defaultdict(float))
+        for key in np.flatnonzero(counts[len(categories):]) + len(categories):
+            month, category = divmod(int(key), len(categories))
+            totals[self.months.values[month - 1]][categories[category] or ''] += float(sums[key])
+        return totals
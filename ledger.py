@@ -0,0 +1,1603 @@
+"""Storage, search, import/export and aggregation of a ContasCertas ledger.
+
+Nothing in here needs Qt, so reports, imports and exports can run
+headless: python ledger.py --help. The PyQt window in main.py is built on
+top of this module.
+"""
+import sys
+import os
+import re
+import csv
+import time
+import argparse
+import datetime
+import itertools
+import threading
+import sqlite3
+from collections import defaultdict, Counter
+from contextlib import contextmanager
+from urllib.request import pathname2url
+
+from timings import connect, timed
+
+# Columns selected for the table; the primary key rides along after the
+# displayed columns so rows can be patched without re-querying.
+SELECT_COLUMNS = "date, value, type, supplier, funds, category, subcategory, subsubcategory, id"
+ID_INDEX = 8
+COLUMN_NAMES = SELECT_COLUMNS.split(', ')[:ID_INDEX]
+
+# Searches on these low-cardinality columns are matched against their distinct
+# values in Python and sent to SQLite as an IN (...) list the indexes can serve.
+# The taxonomy columns are matched against the cached Taxonomy and filtered by id.
+VOCABULARY_COLUMNS = ('type', 'funds')
+TAXONOMY_COLUMNS = ('category', 'subcategory', 'subsubcategory')
+MAX_IN_VALUES = 500
+
+# Types counted as money coming in (compared lowercased); any other non-empty
+# type is money going out. The entry form stores 'Crédito', older rows 'Credit'.
+CREDIT_TYPES = ('credit', 'crédito', 'credito')
+
+# Taxonomy the Taxonomy table is seeded with on a new database
+DEFAULT_SUBCATEGORIES = {
+    'Despesas Gerais': ['Supermercado', 'Refeições Escolares', 'Telecomunicações', 'Vestuário', 'Impostos',
+                        'Banco'],
+    'Deslocação': ['Viatura 1', 'Viatura 2', 'Viatura 3', 'Transportes Públicos'],
+    'Estética': ['Cabeleireiro', 'Depilação', 'Unhas'],
+    'Formação': ['Actividades Extra-curriculares', 'Curos e Workshoops', 'Material Didático/ Equipamentos'],
+    'Habitação': ['Seguros', 'Prestação', 'Impostos', 'Manutenção', 'Energia e Recursos', 'Condominio',
+                  'Melhorias e Manutenção'],
+    'Lazer': ['Restauração e Cafetaria', 'Férias', 'Hobbies', 'Actividades Lúdicas', 'Eventos Festivos'],
+    'Saúde e Bem-estar': ['Consultas e Exames', 'Seguros', 'Farmácia', 'Equipamentos', 'Ginásio', 'Saúde Oral'],
+    'Receitas': ['Ordenado', 'Comissões', 'Seguros', 'Aplicações Bancárias', 'Actividades Extra-profissionais']
+}
+
+DEFAULT_SUBSUBCATEGORIES = {
+    'Viatura 1': ['Combustível', 'Seguro', 'Inspecção', 'Manutenção', 'Portagens', 'Impostos',
+                  'Multas', 'Estacionamento', 'Outra'],
+    'Viatura 2': ['Combustível', 'Seguro', 'Inspecção', 'Manutenção', 'Portagens', 'Impostos',
+                  'Multas', 'Estacionamento', 'Outra'],
+    'Viatura 3': ['Combustível', 'Seguro', 'Inspecção', 'Manutenção', 'Portagens', 'Impostos',
+                  'Multas', 'Estacionamento', 'Outra'],
+    'Transportes Públicos': ['Autocarro', 'Comboio', 'Taxi/Uber', 'Metro', 'Barco', 'Outra'],
+    'Outra': []
+}
+
+DEFAULT_SUBSUBCATEGORIES.update({
+    'Seguros': ['Quarteira', 'Sobral'],
+    'Prestação': ['Quarteira', 'Sobral'],
+    'Impostos': ['Quarteira', 'Sobral'],
+    'Manutenção': ['Quarteira', 'Sobral'],
+    'Energia e Recursos': ['Quarteira', 'Sobral'],
+    'Condominio': ['Quarteira', 'Sobral'],
+    'Melhorias e Manutenção': ['Quarteira', 'Sobral'],
+})
+
+# Names never offered in the subcategory/subsubcategory combos: placeholders
+# stored by the entry form rather than real taxonomy entries
+UNLISTED_NAMES = ('', 'N/A')
+
+# Rows sent to SQLite per executemany call during a bulk import
+IMPORT_BATCH_SIZE = 5000
+
+# CSV header names accepted for each Transactions column (compared lowercased).
+# Bank statements often split movements into separate debit/credit columns.
+IMPORT_COLUMN_ALIASES = {
+    'date': ('date', 'data', 'data movimento', 'data mov.', 'data valor', 'data operação', 'booking date'),
+    'value': ('value', 'valor', 'amount', 'montante', 'importância'),
+    'type': ('type', 'tipo'),
+    'supplier': ('supplier', 'fornecedor', 'descrição', 'descricao', 'descritivo', 'description', 'payee'),
+    'funds': ('funds', 'fundos', 'conta', 'account'),
+    'category': ('category', 'categoria'),
+    'subcategory': ('subcategory', 'subcategoria'),
+    'subsubcategory': ('subsubcategory', 'subsubcategoria'),
+    'debit': ('debit', 'débito', 'debito', 'saída', 'saida'),
+    'credit': ('credit', 'crédito', 'credito', 'entrada'),
+}
+
+# Rows pulled from the cursor per fetchmany call during an export
+EXPORT_CHUNK_SIZE = 10000
+
+# Read-only connections a ledger's pool lends to background queries at once
+POOL_READERS = 4
+
+# Set on every pooled connection. In WAL mode synchronous=NORMAL still never
+# loses a commit when the app dies, only when the machine does, and saves an
+# fsync per commit; a 16 MB page cache and in-memory temp tables keep the
+# GROUP BYs of reports and imports off the disk.
+CONNECTION_PRAGMAS = ('synchronous=NORMAL', 'temp_store=MEMORY', 'cache_size=-16000')
+
+# Ledger.add(commit=False) commits anyway once this many adds are held back
+MAX_UNCOMMITTED_ADDS = 50
+
+# CONTAS_FTS=1 keeps an FTS5 index of supplier names and searches it by word
+# prefix instead of scanning every row with LIKE.
+USE_FTS = os.environ.get('CONTAS_FTS') == '1'
+
+
+class ColumnVocabulary(dict):
+    """Distinct values of the low-cardinality columns, read on first use"""
+
+    def __init__(self, db):
+        super().__init__()
+        self.db = db
+
+    def __missing__(self, column):
+        cursor = self.db.execute(f"SELECT DISTINCT {column} FROM Transactions WHERE {column} IS NOT NULL")
+        values = self[column] = {row[0] for row in cursor}
+        return values
+
+    def add(self, row):
+        for column, values in self.items():
+            value = row[COLUMN_NAMES.index(column)]
+            if value is not None:
+                values.add(value)
+
+
+def normalize_supplier(name):
+    return ' '.join(name.lower().split())
+
+
+class SupplierNode:
+    __slots__ = ('children', 'top', 'name')
+
+    def __init__(self):
+        self.children = {}
+        self.top = []  # most frequent supplier names below this node, best first
+        self.name = None  # set when a supplier name ends here
+
+
+class SupplierIndex:
+    """Prefix trie of supplier names and the categories each is usually filed under.
+
+    Built once from the historical Transactions and updated on every
+    submit. Each node caches its most frequent completions, so completing
+    a prefix is a walk of len(prefix) nodes whatever the number of
+    suppliers.
+    """
+
+    def __init__(self, max_completions=10):
+        self.max_completions = max_completions
+        self.root = SupplierNode()
+        self.frequency = Counter()
+        self.categories = defaultdict(Counter)
+        self.display = {}
+
+    @classmethod
+    def from_db(cls, db):
+        index = cls()
+        cursor = db.execute("""
+            SELECT supplier, category, subcategory, subsubcategory, COUNT(*) FROM TransactionsView
+            WHERE supplier IS NOT NULL AND supplier != ''
+            GROUP BY 1, 2, 3, 4
+        """)
+        for supplier, category, subcategory, subsubcategory, count in cursor:
+            index.add(supplier, category, subcategory, subsubcategory, count)
+        return index
+
+    def add(self, supplier, category, subcategory, subsubcategory, count=1):
+        key = normalize_supplier(supplier or '')
+        if not key:
+            return
+        self.display[key] = supplier.strip()
+        self.frequency[key] += count
+        if category:
+            self.categories[key][(category, subcategory, subsubcategory)] += count
+        node = self.root
+        self._rank(node, key)
+        for char in key:
+            node = node.children.setdefault(char, SupplierNode())
+            self._rank(node, key)
+        node.name = key
+
+    def remove(self, supplier, category, subcategory, subsubcategory):
+        """Forget one deleted transaction; the name stays available for completion"""
+        key = normalize_supplier(supplier or '')
+        triple = (category, subcategory, subsubcategory)
+        if key in self.frequency:
+            self.frequency[key] -= 1
+        if key in self.categories and triple in self.categories[key]:
+            self.categories[key][triple] -= 1
+            if self.categories[key][triple] <= 0:
+                del self.categories[key][triple]
+            if not self.categories[key]:
+                del self.categories[key]
+
+    def _rank(self, node, key):
+        if key not in node.top:
+            node.top.append(key)
+        node.top.sort(key=self.frequency.__getitem__, reverse=True)
+        del node.top[self.max_completions:]
+
+    def complete(self, prefix, limit=None):
+        """Supplier names starting with prefix, most frequent first"""
+        node = self.root
+        for char in normalize_supplier(prefix):
+            node = node.children.get(char)
+            if node is None:
+                return []
+        return [self.display[key] for key in node.top[:limit]]
+
+    def suggest(self, supplier):
+        """Most likely (category, subcategory, subsubcategory) for a supplier.
+
+        Falls back to the longest known supplier the name starts with at a
+        word boundary, so 'PINGO DOCE LISBOA 123' from a bank statement
+        resolves through 'Pingo Doce'.
+        """
+        key = normalize_supplier(supplier or '')
+        node = self.root
+        best = None
+        for i, char in enumerate(key):
+            node = node.children.get(char)
+            if node is None:
+                break
+            if node.name in self.categories and (i + 1 == len(key) or key[i + 1] == ' '):
+                best = node.name
+        if best is None:
+            return None
+        return self.categories[best].most_common(1)[0][0]
+
+
+def categorize_rows(rows, index):
+    """Fill in missing categories of Transactions tuples from a SupplierIndex"""
+    for row in rows:
+        if row[5] is None and row[3]:
+            suggestion = index.suggest(row[3])
+            if suggestion is not None:
+                row = row[:5] + suggestion + row[8:]
+        yield row
+
+
+class Taxonomy:
+    """In-memory cache of the Taxonomy table.
+
+    Categories, subcategories and subsubcategories are rows of one
+    adjacency table (level 0, 1, 2); Transactions references them by id.
+    Name lookups are dict hits. add() writes through to SQLite and the
+    cache, but leaves committing to the caller so it can be part of a
+    larger transaction; invalidate() rereads the table after another
+    connection changed it.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.invalidate()
+
+    def invalidate(self):
+        self.names = {}
+        self.levels = {}
+        self.ids = {}
+        self.children_ids = defaultdict(list)
+        cursor = self.db.execute("SELECT id, parent_id, level, name FROM Taxonomy ORDER BY id")
+        for node_id, parent_id, level, name in cursor:
+            self._cache(node_id, parent_id, level, name)
+
+    def _cache(self, node_id, parent_id, level, name):
+        self.names[node_id] = name
+        self.levels[node_id] = level
+        self.ids[(parent_id, level, name)] = node_id
+        self.children_ids[(parent_id, level)].append(node_id)
+
+    def add(self, parent_id, level, name):
+        node_id = self.ids.get((parent_id, level, name))
+        if node_id is None:
+            cursor = self.db.execute("INSERT INTO Taxonomy (parent_id, level, name) VALUES (?, ?, ?)",
+                                     (parent_id, level, name))
+            node_id = cursor.lastrowid
+            self._cache(node_id, parent_id, level, name)
+        return node_id
+
+    def resolve(self, category, subcategory, subsubcategory):
+        """Ids for a category path, creating any node that does not exist yet"""
+        ids = []
+        parent_id = 0
+        for level, name in enumerate((category, subcategory, subsubcategory)):
+            node_id = None if name is None else self.add(parent_id, level, name)
+            ids.append(node_id)
+            parent_id = node_id or 0
+        return tuple(ids)
+
+    def node_id(self, *path):
+        parent_id = 0
+        for level, name in enumerate(path):
+            parent_id = self.ids.get((parent_id, level, name))
+            if parent_id is None:
+                return None
+        return parent_id
+
+    def children(self, *path):
+        """Names listed under a path; children() gives the categories"""
+        parent_id = self.node_id(*path) if path else 0
+        if parent_id is None:
+            return []
+        names = [self.names[i] for i in self.children_ids[(parent_id, len(path))]]
+        return [name for name in names if name not in UNLISTED_NAMES]
+
+    def matching(self, level, text):
+        """Ids of the nodes at a level whose name contains text (lowercase)"""
+        return [node_id for node_id, name in self.names.items()
+                if self.levels[node_id] == level and text in name.lower()]
+
+
+def like_clause(column, text):
+    escaped = text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f"{column} LIKE ? ESCAPE '\\'", f"%{escaped}%"
+
+
+def fts_query(text):
+    """Build an FTS5 query that matches every word of text as a prefix"""
+    return " AND ".join(f'"{token}"*' for token in re.findall(r'\w+', text))
+
+
+def build_filter_clause(filters, vocabulary=None, fts=False, taxonomy=None, date_range=None):
+    """Turn the search box texts into a WHERE clause on TransactionsView and its parameters.
+
+    date_range is an optional inclusive (from, to) pair of ISO dates,
+    answered by a range scan on the date index.
+    """
+    clauses = []
+    params = []
+    if date_range is not None:
+        clauses.append("date BETWEEN ? AND ?")
+        params.extend(date_range)
+    for column, text in zip(COLUMN_NAMES, filters):
+        if not text:
+            continue
+        matches = None
+        in_column = column
+        if vocabulary is not None and column in VOCABULARY_COLUMNS:
+            matches = [value for value in vocabulary[column] if text in str(value).lower()]
+        elif taxonomy is not None and column in TAXONOMY_COLUMNS:
+            matches = taxonomy.matching(TAXONOMY_COLUMNS.index(column), text)
+            in_column = f"{column}_id"
+        if matches is not None and len(matches) <= MAX_IN_VALUES:
+            if matches:
+                clauses.append(f"{in_column} IN ({', '.join('?' * len(matches))})")
+                params.extend(matches)
+            else:
+                clauses.append("0")
+            continue
+        if column == 'supplier' and fts:
+            query = fts_query(text)
+            if query:
+                clauses.append("id IN (SELECT rowid FROM TransactionsSearch WHERE TransactionsSearch MATCH ?)")
+                params.append(query)
+                continue
+        clause, param = like_clause(column, text)
+        clauses.append(clause)
+        params.append(param)
+    return " AND ".join(clauses), params
+
+
+def default_db_path():
+    """Get the correct database path for both development and executable"""
+    if getattr(sys, 'frozen', False):
+        # Use a safe, writable directory in user profile
+        appdata_dir = os.path.join(os.path.expanduser("~"), ".budget_app")
+        os.makedirs(appdata_dir, exist_ok=True)
+        return os.path.join(appdata_dir, "budget.db")
+    else:
+        return "budget.db"
+
+
+def ledger_paths(directory=None):
+    """The ledger files kept beside the default one, one per household or entity.
+
+    Only .db files with a Transactions table are ledgers; other SQLite
+    files that happen to sit in the same directory are left alone.
+    """
+    directory = directory or os.path.dirname(os.path.abspath(default_db_path()))
+    paths = (os.path.join(directory, name) for name in os.listdir(directory) if name.endswith('.db'))
+    return sorted(path for path in paths if 'Transactions' in schema_names(path))
+
+
+def schema_names(path):
+    """Names of the tables and views in a SQLite file, read without writing to it; empty for anything else"""
+    try:
+        db = connect(f"file:{pathname2url(os.path.abspath(path))}?mode=ro", uri=True)
+    except sqlite3.Error:
+        return set()
+    try:
+        return {name for (name,) in db.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'view')")}
+    except sqlite3.Error:
+        return set()
+    finally:
+        db.close()
+
+
+def ledger_name(path):
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def create_schema(db):
+    """Create tables, indexes and triggers; returns whether FTS search is available"""
+    cursor = db.cursor()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS Taxonomy (
+            id INTEGER PRIMARY KEY,
+            parent_id INTEGER NOT NULL DEFAULT 0,
+            level INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            UNIQUE (parent_id, level, name)
+        )
+    ''')
+    if cursor.execute("SELECT COUNT(*) FROM Taxonomy").fetchone()[0] == 0:
+        seed_taxonomy(db)
+    migrated = migrate_category_columns(db)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS Transactions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            date TEXT,
+            value REAL,
+            type TEXT,
+            supplier TEXT,
+            funds TEXT,
+            category_id INTEGER REFERENCES Taxonomy(id),
+            subcategory_id INTEGER REFERENCES Taxonomy(id),
+            subsubcategory_id INTEGER REFERENCES Taxonomy(id)
+        )
+    ''')
+    if db.execute("PRAGMA user_version").fetchone()[0] < 1:
+        migrate_dates(db)
+        db.execute("PRAGMA user_version = 1")
+    for column in ('date', 'value', 'type', 'supplier', 'funds', 'category_id', 'subcategory_id', 'subsubcategory_id'):
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_transactions_{column} ON Transactions({column})")
+    # Reads go through the view so they keep seeing category names
+    cursor.execute('''
+        CREATE VIEW IF NOT EXISTS TransactionsView AS
+        SELECT t.id, t.date, t.value, t.type, t.supplier, t.funds,
+               c.name AS category, s.name AS subcategory, ss.name AS subsubcategory,
+               t.category_id, t.subcategory_id, t.subsubcategory_id
+        FROM Transactions t
+        LEFT JOIN Taxonomy c ON c.id = t.category_id
+        LEFT JOIN Taxonomy s ON s.id = t.subcategory_id
+        LEFT JOIN Taxonomy ss ON ss.id = t.subsubcategory_id
+    ''')
+    create_monthly_totals(cursor)
+    create_change_log(cursor)
+    # Monthly spending (or income) target per category; month '' is the default for every month
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS Budgets (
+            category_id INTEGER NOT NULL REFERENCES Taxonomy(id),
+            month TEXT NOT NULL DEFAULT '',
+            amount REAL NOT NULL,
+            PRIMARY KEY (category_id, month)
+        ) WITHOUT ROWID
+    ''')
+    fts_enabled = create_search_index(cursor) if USE_FTS else False
+    db.commit()
+    if migrated:
+        # Reclaim the space of the old TEXT columns
+        db.execute("VACUUM")
+    return fts_enabled
+
+
+# The Transactions columns ChangeLog keeps a copy of, id first
+CHANGE_LOG_COLUMNS = ('id', 'date', 'value', 'type', 'supplier', 'funds', 'category_id', 'subcategory_id',
+                      'subsubcategory_id')
+
+
+def change_log_values(prefix):
+    return ', '.join(f"{prefix}.{column}" for column in CHANGE_LOG_COLUMNS)
+
+
+# Every row that enters or leaves Transactions is appended to ChangeLog,
+# op +1 and -1 respectively, tagged with the newest ChangeBatch
+CHANGE_LOG_TRIGGERS = {
+    'change_log_insert': f"""
+        CREATE TRIGGER IF NOT EXISTS change_log_insert AFTER INSERT ON Transactions BEGIN
+            INSERT INTO ChangeLog (batch, undoes, op, {', '.join(CHANGE_LOG_COLUMNS)})
+            SELECT b.id, b.undoes, 1, {change_log_values('new')} FROM CurrentBatch b;
+        END
+    """,
+    'change_log_delete': f"""
+        CREATE TRIGGER IF NOT EXISTS change_log_delete AFTER DELETE ON Transactions BEGIN
+            INSERT INTO ChangeLog (batch, undoes, op, {', '.join(CHANGE_LOG_COLUMNS)})
+            SELECT b.id, b.undoes, -1, {change_log_values('old')} FROM CurrentBatch b;
+        END
+    """,
+    'change_log_update': f"""
+        CREATE TRIGGER IF NOT EXISTS change_log_update AFTER UPDATE ON Transactions BEGIN
+            INSERT INTO ChangeLog (batch, undoes, op, {', '.join(CHANGE_LOG_COLUMNS)})
+            SELECT b.id, b.undoes, -1, {change_log_values('old')} FROM CurrentBatch b;
+            INSERT INTO ChangeLog (batch, undoes, op, {', '.join(CHANGE_LOG_COLUMNS)})
+            SELECT b.id, b.undoes, 1, {change_log_values('new')} FROM CurrentBatch b;
+        END
+    """,
+}
+
+
+def create_change_log(cursor):
+    """Create the append-only ChangeLog, its ChangeBatch list and triggers; a new log starts as batch 0"""
+    exists = cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'ChangeLog'").fetchone()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS ChangeLog (
+            seq INTEGER PRIMARY KEY,
+            batch INTEGER NOT NULL,
+            undoes INTEGER,
+            op INTEGER NOT NULL,
+            id INTEGER NOT NULL,
+            date TEXT,
+            value REAL,
+            type TEXT,
+            supplier TEXT,
+            funds TEXT,
+            category_id INTEGER,
+            subcategory_id INTEGER,
+            subsubcategory_id INTEGER
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_change_log_batch ON ChangeLog(batch)")
+    # One row per batch, so finding the one to undo reads batches, not logged rows
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS ChangeBatch (
+            id INTEGER PRIMARY KEY,
+            undoes INTEGER,
+            undone INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    cursor.execute("""
+        CREATE VIEW IF NOT EXISTS CurrentBatch AS
+        SELECT id, undoes FROM ChangeBatch ORDER BY id DESC LIMIT 1
+    """)
+    if not exists:
+        columns = ', '.join(CHANGE_LOG_COLUMNS)
+        cursor.execute("INSERT INTO ChangeBatch (id) VALUES (0)")
+        cursor.execute(f"INSERT INTO ChangeLog (batch, op, {columns}) SELECT 0, 1, {columns} FROM Transactions")
+    for sql in CHANGE_LOG_TRIGGERS.values():
+        cursor.execute(sql)
+
+
+def begin_batch(db, undoes=None):
+    """Start a new ChangeLog batch for the writes that follow, in the caller's transaction"""
+    db.execute("INSERT INTO ChangeBatch (undoes) VALUES (?)", (undoes,))
+
+
+def last_undoable_batch(db):
+    """The newest batch after batch 0 that is neither an undo nor undone yet, or None"""
+    row = db.execute("""
+        SELECT id FROM ChangeBatch WHERE id > 0 AND undoes IS NULL AND NOT undone
+        ORDER BY id DESC LIMIT 1
+    """).fetchone()
+    return row[0] if row else None
+
+
+def batch_counts(db, batch):
+    """(rows added, rows deleted) by one batch"""
+    row = db.execute("SELECT COUNT(*), SUM(op < 0) FROM ChangeLog WHERE batch = ?", (batch,)).fetchone()
+    return row[0] - (row[1] or 0), row[1] or 0
+
+
+def undo_batch(db, batch):
+    """Reverse one batch as a new one, in the caller's transaction; restored rows keep their ids"""
+    columns = ', '.join(CHANGE_LOG_COLUMNS)
+    begin_batch(db, undoes=batch)
+    db.execute("UPDATE ChangeBatch SET undone = 1 WHERE id = ?", (batch,))
+    db.execute("DELETE FROM Transactions WHERE id IN (SELECT id FROM ChangeLog WHERE batch = ? AND op = 1)",
+               (batch,))
+    db.execute(f"INSERT INTO Transactions ({columns}) SELECT {columns} FROM ChangeLog "
+               f"WHERE batch = ? AND op = -1 ORDER BY seq", (batch,))
+
+
+def replay_change_log(cursor):
+    """Recompute MonthlyTotals from ChangeLog alone: every row logged in, less every row logged out"""
+    cursor.execute("DELETE FROM MonthlyTotals")
+    cursor.execute("""
+        INSERT INTO MonthlyTotals (month, category_id, type, total, count)
+        SELECT COALESCE(substr(date, 1, 7), ''), COALESCE(category_id, 0), COALESCE(type, ''),
+               SUM(op * value), SUM(op)
+        FROM ChangeLog WHERE value IS NOT NULL
+        GROUP BY 1, 2, 3
+        HAVING SUM(op) > 0
+    """)
+
+
+def migrate_dates(db):
+    """Rewrite stored dates that are not ISO yet; unrecognised ones are left alone"""
+    rows = db.execute("""
+        SELECT id, date FROM Transactions
+        WHERE date IS NOT NULL AND date NOT GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]'
+    """).fetchall()
+    updates = []
+    for row_id, date in rows:
+        try:
+            updates.append((normalize_date(date), row_id))
+        except ValueError:
+            print(f"Leaving unrecognised date {date!r} of transaction {row_id} as is")
+    # The MonthlyTotals update trigger moves each row to its corrected month
+    db.executemany("UPDATE Transactions SET date = ? WHERE id = ?", updates)
+    if updates:
+        print(f"Normalised {len(updates)} dates to ISO format")
+
+
+def seed_taxonomy(db):
+    """Fill an empty Taxonomy with the defaults and any legacy Subcategories rows"""
+    taxonomy = Taxonomy(db)
+    for category, subcategories in DEFAULT_SUBCATEGORIES.items():
+        for subcategory in subcategories:
+            for subsubcategory in DEFAULT_SUBSUBCATEGORIES.get(subcategory, []):
+                taxonomy.resolve(category, subcategory, subsubcategory)
+            taxonomy.resolve(category, subcategory, None)
+    legacy = db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'Subcategories'").fetchone()
+    if legacy:
+        for category, subcategory in db.execute("SELECT category, subcategory FROM Subcategories"):
+            if category and subcategory and subcategory != 'Outra':
+                taxonomy.resolve(category, subcategory, None)
+
+
+def migrate_category_columns(db):
+    """Move a Transactions table with TEXT category columns over to Taxonomy ids.
+
+    Every distinct category path in use becomes a Taxonomy node, so no
+    value is lost. Runs in one transaction; returns whether anything was
+    migrated.
+    """
+    columns = [row[1] for row in db.execute("PRAGMA table_info(Transactions)")]
+    if 'category' not in columns:
+        return False
+    print("Migrating categories to the Taxonomy table...")
+    if not db.in_transaction:
+        db.execute("BEGIN")
+    taxonomy = Taxonomy(db)
+    paths = db.execute("SELECT DISTINCT category, subcategory, subsubcategory FROM Transactions").fetchall()
+    for path in paths:
+        taxonomy.resolve(*path)
+    sequence = db.execute("SELECT seq FROM sqlite_sequence WHERE name = 'Transactions'").fetchone()
+    db.execute('''
+        CREATE TABLE Transactions_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            date TEXT,
+            value REAL,
+            type TEXT,
+            supplier TEXT,
+            funds TEXT,
+            category_id INTEGER REFERENCES Taxonomy(id),
+            subcategory_id INTEGER REFERENCES Taxonomy(id),
+            subsubcategory_id INTEGER REFERENCES Taxonomy(id)
+        )
+    ''')
+    db.execute('''
+        INSERT INTO Transactions_new
+        SELECT t.id, t.date, t.value, t.type, t.supplier, t.funds, c.id, s.id, ss.id
+        FROM Transactions t
+        LEFT JOIN Taxonomy c ON c.parent_id = 0 AND c.level = 0 AND c.name = t.category
+        LEFT JOIN Taxonomy s ON s.parent_id = COALESCE(c.id, 0) AND s.level = 1 AND s.name = t.subcategory
+        LEFT JOIN Taxonomy ss ON ss.parent_id = COALESCE(s.id, 0) AND ss.level = 2 AND ss.name = t.subsubcategory
+    ''')
+    db.execute("DROP TABLE Transactions")
+    db.execute("ALTER TABLE Transactions_new RENAME TO Transactions")
+    if sequence:
+        # Keep ids of deleted rows from being handed out again
+        db.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'Transactions'", sequence)
+    # MonthlyTotals was keyed by category name; it is rebuilt by id
+    db.execute("DROP TABLE IF EXISTS MonthlyTotals")
+    db.commit()
+    return True
+
+
+# Triggers that keep MonthlyTotals in step with Transactions. Rows without a
+# date are kept under month '' so the totals still add up to the whole table;
+# rows without a value contribute nothing.
+MONTHLY_TOTALS_TRIGGERS = {
+    'monthly_totals_insert': """
+        CREATE TRIGGER IF NOT EXISTS monthly_totals_insert AFTER INSERT ON Transactions
+        WHEN new.value IS NOT NULL BEGIN
+            INSERT INTO MonthlyTotals (month, category_id, type, total, count)
+            VALUES (COALESCE(substr(new.date, 1, 7), ''), COALESCE(new.category_id, 0),
+                    COALESCE(new.type, ''), new.value, 1)
+            ON CONFLICT (month, category_id, type)
+            DO UPDATE SET total = total + excluded.total, count = count + 1;
+        END
+    """,
+    'monthly_totals_delete': """
+        CREATE TRIGGER IF NOT EXISTS monthly_totals_delete AFTER DELETE ON Transactions
+        WHEN old.value IS NOT NULL BEGIN
+            UPDATE MonthlyTotals SET total = total - old.value, count = count - 1
+            WHERE month = COALESCE(substr(old.date, 1, 7), '') AND category_id = COALESCE(old.category_id, 0)
+              AND type = COALESCE(old.type, '');
+            DELETE FROM MonthlyTotals
+            WHERE month = COALESCE(substr(old.date, 1, 7), '') AND category_id = COALESCE(old.category_id, 0)
+              AND type = COALESCE(old.type, '') AND count <= 0;
+        END
+    """,
+    'monthly_totals_update': """
+        CREATE TRIGGER IF NOT EXISTS monthly_totals_update AFTER UPDATE OF date, value, type, category_id
+        ON Transactions BEGIN
+            UPDATE MonthlyTotals SET total = total - old.value, count = count - 1
+            WHERE old.value IS NOT NULL
+              AND month = COALESCE(substr(old.date, 1, 7), '') AND category_id = COALESCE(old.category_id, 0)
+              AND type = COALESCE(old.type, '');
+            DELETE FROM MonthlyTotals
+            WHERE month = COALESCE(substr(old.date, 1, 7), '') AND category_id = COALESCE(old.category_id, 0)
+              AND type = COALESCE(old.type, '') AND count <= 0;
+            INSERT INTO MonthlyTotals (month, category_id, type, total, count)
+            SELECT COALESCE(substr(new.date, 1, 7), ''), COALESCE(new.category_id, 0),
+                   COALESCE(new.type, ''), new.value, 1
+            WHERE new.value IS NOT NULL
+            ON CONFLICT (month, category_id, type)
+            DO UPDATE SET total = total + excluded.total, count = count + 1;
+        END
+    """,
+}
+
+
+def create_monthly_totals(cursor):
+    """Create the MonthlyTotals summary table and the triggers that keep it current"""
+    exists = cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'MonthlyTotals'").fetchone()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS MonthlyTotals (
+            month TEXT NOT NULL,
+            category_id INTEGER NOT NULL,
+            type TEXT NOT NULL,
+            total REAL NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (month, category_id, type)
+        ) WITHOUT ROWID
+    """)
+    for sql in MONTHLY_TOTALS_TRIGGERS.values():
+        cursor.execute(sql)
+    if not exists:
+        rebuild_monthly_totals(cursor)
+
+
+def rebuild_monthly_totals(cursor):
+    """Recompute MonthlyTotals from scratch, e.g. for databases created before it existed"""
+    cursor.execute("DELETE FROM MonthlyTotals")
+    cursor.execute("""
+        INSERT INTO MonthlyTotals (month, category_id, type, total, count)
+        SELECT COALESCE(substr(date, 1, 7), ''), COALESCE(category_id, 0), COALESCE(type, ''),
+               SUM(value), COUNT(*)
+        FROM Transactions WHERE value IS NOT NULL
+        GROUP BY 1, 2, 3
+    """)
+
+
+def create_search_index(cursor):
+    """Create the FTS5 supplier index and the triggers that keep it in sync"""
+    exists = cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'TransactionsSearch'").fetchone()
+    try:
+        cursor.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS TransactionsSearch USING fts5(
+                supplier, content='Transactions', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 0'
+            )
+        """)
+    except sqlite3.OperationalError as e:
+        print(f"Full-text search unavailable: {e}")
+        return False
+    cursor.executescript("""
+        CREATE TRIGGER IF NOT EXISTS transactions_search_insert AFTER INSERT ON Transactions BEGIN
+            INSERT INTO TransactionsSearch(rowid, supplier) VALUES (new.id, new.supplier);
+        END;
+        CREATE TRIGGER IF NOT EXISTS transactions_search_delete AFTER DELETE ON Transactions BEGIN
+            INSERT INTO TransactionsSearch(TransactionsSearch, rowid, supplier)
+            VALUES ('delete', old.id, old.supplier);
+        END;
+        CREATE TRIGGER IF NOT EXISTS transactions_search_update AFTER UPDATE OF supplier ON Transactions BEGIN
+            INSERT INTO TransactionsSearch(TransactionsSearch, rowid, supplier)
+            VALUES ('delete', old.id, old.supplier);
+            INSERT INTO TransactionsSearch(rowid, supplier) VALUES (new.id, new.supplier);
+        END;
+    """)
+    if not exists:
+        cursor.execute("INSERT INTO TransactionsSearch(TransactionsSearch) VALUES ('rebuild')")
+    return True
+
+
+def query_total(db, where, params):
+    """Signed sum of the transactions matching a WHERE clause"""
+    if not where:
+        # Unfiltered totals come from the summary table instead of every row
+        return db.execute(f"SELECT {signed_sum('total')} FROM MonthlyTotals").fetchone()[0] or 0.0
+    cursor = db.execute(f"SELECT {signed_sum()} FROM TransactionsView WHERE {where}", params)
+    return cursor.fetchone()[0] or 0.0
+
+
+def normalize_date(text):
+    """Turn the date formats people type or banks export into ISO 'YYYY-MM-DD'.
+
+    Accepts the entry form's short 'YYMM' (stored as the 1st of the month)
+    and 'YYMMDD', 'YYYYMMDD', 'YYYY-MM[-DD]' and day-first 'DD-MM-YY[YY]'
+    with -, / or . separators. Raises ValueError for anything else.
+    """
+    text = (text or '').strip()
+    parts = re.split(r'[-/.]', text)
+    if len(parts) == 1 and text.isdigit() and len(text) in (4, 6, 8):
+        if len(text) == 8:
+            parts = [text[:4], text[4:6], text[6:]]
+        else:
+            parts = ['20' + text[:2], text[2:4], text[4:] or '01']
+    elif len(parts) == 2 and len(parts[0]) == 4:
+        parts.append('01')
+    elif len(parts) == 3 and len(parts[0]) <= 2:
+        day, month, year = parts
+        parts = [year if len(year) == 4 else '20' + year, month, day]
+    if len(parts) != 3 or not all(part.isdigit() for part in parts) or len(parts[0]) != 4:
+        raise ValueError(f"Unrecognised date: {text!r}")
+    return datetime.date(int(parts[0]), int(parts[1]), int(parts[2])).isoformat()
+
+
+def normalize_month(text):
+    """'YYYY-MM' of any date normalize_date accepts, e.g. '2505' or '2025-05'"""
+    return normalize_date(text)[:7]
+
+
+def parse_amount(text):
+    """Parse amounts like '1.234,56', '1,234.56', '-12,5 €' into a float"""
+    text = re.sub(r'[^\d,.\-+]', '', text or '')
+    if not text:
+        raise ValueError("empty amount")
+    if ',' in text and '.' in text:
+        # Whichever separator comes last is the decimal one
+        if text.rfind(',') > text.rfind('.'):
+            text = text.replace('.', '').replace(',', '.')
+        else:
+            text = text.replace(',', '')
+    elif ',' in text:
+        text = text.replace(',', '.')
+    return float(text)
+
+
+def iter_csv_rows(path, funds=None, rejected=None):
+    """Stream a CSV or bank export as Transactions tuples, one row at a time.
+
+    The delimiter is sniffed and headers are mapped through
+    IMPORT_COLUMN_ALIASES. Without a type column the sign of the amount
+    (or which of the debit/credit columns is filled) decides between
+    Débito and Crédito. Unparseable lines are skipped and their line
+    numbers appended to rejected.
+    """
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        sample = f.read(4096)
+        f.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=',;\t|')
+        except csv.Error:
+            dialect = csv.excel
+        reader = csv.reader(f, dialect)
+        header = [name.strip().lower() for name in next(reader, [])]
+        positions = {}
+        for column, aliases in IMPORT_COLUMN_ALIASES.items():
+            for i, name in enumerate(header):
+                if name in aliases:
+                    positions[column] = i
+                    break
+        if 'value' not in positions and 'debit' not in positions and 'credit' not in positions:
+            raise ValueError(f"No amount column found in {path}")
+
+        def field(record, column):
+            i = positions.get(column)
+            if i is None or i >= len(record):
+                return None
+            return record[i].strip() or None
+
+        for line, record in enumerate(reader, start=2):
+            if not any(cell.strip() for cell in record):
+                continue
+            try:
+                date = field(record, 'date')
+                if date is not None:
+                    date = normalize_date(date)
+                ttype = field(record, 'type')
+                if field(record, 'value') is not None:
+                    value = parse_amount(field(record, 'value'))
+                elif field(record, 'credit') is not None:
+                    value = abs(parse_amount(field(record, 'credit')))
+                    ttype = ttype or 'Crédito'
+                else:
+                    value = -abs(parse_amount(field(record, 'debit')))
+                    ttype = ttype or 'Débito'
+            except (TypeError, ValueError):
+                if rejected is not None:
+                    rejected.append(line)
+                continue
+            if ttype is None:
+                ttype = 'Crédito' if value > 0 else 'Débito'
+            elif ttype.lower() in CREDIT_TYPES + ('c',):
+                ttype = 'Crédito'
+            elif ttype.lower() in ('debit', 'débito', 'debito', 'd'):
+                ttype = 'Débito'
+            category = field(record, 'category')
+            if category is None and ttype == 'Crédito':
+                category = 'Receitas'
+            yield (
+                date,
+                abs(value),
+                ttype,
+                field(record, 'supplier'),
+                field(record, 'funds') or funds,
+                category,
+                field(record, 'subcategory'),
+                field(record, 'subsubcategory') or 'N/A',
+            )
+
+
+def import_rows(db, rows, batch_size=IMPORT_BATCH_SIZE, progress=None):
+    """Insert Transactions tuples in batches in one transaction, as one ChangeLog batch; returns the row count"""
+    rows = iter(rows)
+    batch = list(itertools.islice(rows, batch_size))
+    if not batch:
+        # Nothing to import, so no empty batch for undo to land on
+        return 0
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    count = 0
+    with db:
+        if not db.in_transaction:
+            db.execute("BEGIN")
+        taxonomy = Taxonomy(db)
+        last_id = db.execute("SELECT COALESCE(MAX(id), 0) FROM Transactions").fetchone()[0]
+        begin_batch(db)
+        # The per-row triggers are replaced by one GROUP BY and one INSERT ... SELECT
+        # below; DDL is transactional, so other connections never see them missing
+        for name in itertools.chain(MONTHLY_TOTALS_TRIGGERS, CHANGE_LOG_TRIGGERS):
+            db.execute(f"DROP TRIGGER IF EXISTS {name}")
+        while batch:
+            db.executemany("""
+                INSERT INTO Transactions
+                (date, value, type, supplier, funds, category_id, subcategory_id, subsubcategory_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, [row[:5] + taxonomy.resolve(*row[5:8]) for row in batch])
+            count += len(batch)
+            if progress is not None:
+                progress(count)
+            batch = list(itertools.islice(rows, batch_size))
+        db.execute("""
+            INSERT INTO MonthlyTotals (month, category_id, type, total, count)
+            SELECT COALESCE(substr(date, 1, 7), ''), COALESCE(category_id, 0), COALESCE(type, ''),
+                   SUM(value), COUNT(*)
+            FROM Transactions WHERE id > ? AND value IS NOT NULL
+            GROUP BY 1, 2, 3
+            ON CONFLICT (month, category_id, type)
+            DO UPDATE SET total = total + excluded.total, count = count + excluded.count
+        """, (last_id,))
+        columns = ', '.join(CHANGE_LOG_COLUMNS)
+        db.execute(f"""
+            INSERT INTO ChangeLog (batch, op, {columns})
+            SELECT (SELECT id FROM CurrentBatch), 1, {columns} FROM Transactions WHERE id > ?
+        """, (last_id,))
+        for sql in itertools.chain(MONTHLY_TOTALS_TRIGGERS.values(), CHANGE_LOG_TRIGGERS.values()):
+            db.execute(sql)
+    return count
+
+
+def import_csv(db, path, funds=None, progress=None):
+    """Import a CSV file; returns (rows imported, rejected line numbers, seconds)"""
+    rejected = []
+    start = time.perf_counter()
+    rows = categorize_rows(iter_csv_rows(path, funds, rejected), SupplierIndex.from_db(db))
+    count = import_rows(db, rows, progress=progress)
+    return count, rejected, time.perf_counter() - start
+
+
+def iter_query_chunks(db, where, params, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield the rows matching a WHERE clause in fetchmany chunks, newest first"""
+    cursor = db.cursor()
+    cursor.execute(f"SELECT {SELECT_COLUMNS} FROM TransactionsView {'WHERE ' + where if where else ''} "
+                   f"ORDER BY id DESC", params)
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        yield rows
+
+
+def write_csv_chunks(path, chunks, on_chunk):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(COLUMN_NAMES)
+        for rows in chunks:
+            writer.writerows(row[:ID_INDEX] for row in rows)
+            if not on_chunk(len(rows)):
+                return False
+    return True
+
+
+def write_parquet_chunks(path, chunks, on_chunk):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Parquet export needs pyarrow (pip install pyarrow)")
+    schema = pa.schema([(name, pa.float64() if name == 'value' else pa.string()) for name in COLUMN_NAMES])
+    with pq.ParquetWriter(path, schema) as writer:
+        for rows in chunks:
+            columns = [list(column) for column in zip(*rows)][:ID_INDEX]
+            writer.write_table(pa.Table.from_arrays(columns, schema=schema))
+            if not on_chunk(len(rows)):
+                return False
+    return True
+
+
+def export_rows(db, path, where="", params=(), progress=None, cancelled=None):
+    """Stream the rows matching a WHERE clause to a .csv or .parquet file.
+
+    Rows are read in fetchmany chunks so memory use does not depend on the
+    size of the ledger. progress(done, total) is called after each chunk
+    and cancelled() is polled between chunks; a cancelled export removes
+    the partial file. Returns the number of rows written, or None if
+    cancelled.
+    """
+    total = db.execute(f"SELECT COUNT(*) FROM TransactionsView {'WHERE ' + where if where else ''}",
+                       params).fetchone()[0]
+    done = 0
+
+    def on_chunk(count):
+        nonlocal done
+        done += count
+        if progress is not None:
+            progress(done, total)
+        return not (cancelled is not None and cancelled())
+
+    writer = write_parquet_chunks if path.lower().endswith('.parquet') else write_csv_chunks
+    if not writer(path, iter_query_chunks(db, where, params), on_chunk):
+        os.remove(path)
+        return None
+    return done
+
+
+def signed_sum(value_column='value', type_column='type'):
+    """SQL summing credits as positive and everything else as negative; rows without a type count 0"""
+    credit = ', '.join(f"'{ttype}'" for ttype in CREDIT_TYPES)
+    return (f"SUM(CASE WHEN COALESCE({type_column}, '') = '' THEN 0 "
+            f"WHEN lower({type_column}) IN ({credit}) THEN {value_column} ELSE -{value_column} END)")
+
+
+def signed_amount(row):
+    """Signed contribution of a Transactions row to a running total"""
+    try:
+        val = float(row[1])
+        ttype = row[2].lower()
+    except (TypeError, ValueError, AttributeError):
+        return 0.0
+    if not ttype:
+        return 0.0
+    return val if ttype in CREDIT_TYPES else -val
+
+
+def query_rows(db, where="", params=(), limit=None, order="id DESC"):
+    """Rows of TransactionsView matching a WHERE clause, newest first unless another order is given"""
+    where = f"WHERE {where}" if where else ""
+    limit = f"LIMIT {int(limit)}" if limit else ""
+    cursor = db.cursor()
+    cursor.execute(f"SELECT {SELECT_COLUMNS} FROM TransactionsView {where} ORDER BY {order} {limit}", params)
+    return cursor.fetchall()
+
+
+# Grouping keys accepted by summarize(), as expressions on TransactionsView.
+# The ones also in SUMMARY_TOTALS_KEYS can be answered from MonthlyTotals.
+SUMMARY_KEYS = {
+    'ledger': "ledger",
+    'year': "substr(date, 1, 4)",
+    'month': "substr(date, 1, 7)",
+    'type': "type",
+    'funds': "funds",
+    'supplier': "supplier",
+    'category': "category",
+    'subcategory': "subcategory",
+    'subsubcategory': "subsubcategory",
+}
+SUMMARY_TOTALS_KEYS = {
+    'ledger': "ledger",
+    'year': "substr(NULLIF(month, ''), 1, 4)",
+    'month': "NULLIF(month, '')",
+    'type': "NULLIF(type, '')",
+    'category': "category",
+}
+
+
+def summarize(db, by, where="", params=(), schemas=None):
+    """Signed total and row count per group, e.g. by=('month', 'category').
+
+    Unfiltered summaries on month, year, type and category are read from
+    MonthlyTotals; anything else aggregates the matching rows. schemas
+    maps attached schemas to ledger names (default: main only): their
+    rows are summed together, and grouping by 'ledger' keeps them apart.
+    The WHERE clause is applied to each schema's rows, so it must not
+    rely on ids or tables of one ledger.
+    """
+    unknown = [key for key in by if key not in SUMMARY_KEYS]
+    if unknown:
+        raise ValueError(f"Unknown summary key(s): {', '.join(unknown)}")
+    schemas = schemas or {'main': ''}
+    order = ", ".join(str(i + 1) for i in range(len(by)))
+    if not where and all(key in SUMMARY_TOTALS_KEYS for key in by):
+        keys = "".join(f"{SUMMARY_TOTALS_KEYS[key]}, " for key in by)
+        source = " UNION ALL ".join(f"""
+            SELECT ? AS ledger, m.month, m.type, m.total, m.count, c.name AS category
+            FROM {schema}.MonthlyTotals m LEFT JOIN {schema}.Taxonomy c ON c.id = m.category_id
+        """ for schema in schemas)
+        sql = f"SELECT {keys}{signed_sum('total')}, SUM(count) FROM ({source})"
+        params = list(schemas.values())
+    else:
+        keys = "".join(f"{SUMMARY_KEYS[key]}, " for key in by)
+        source = " UNION ALL ".join(f"""
+            SELECT ? AS ledger, * FROM {schema}.TransactionsView {'WHERE ' + where if where else ''}
+        """ for schema in schemas)
+        sql = f"SELECT {keys}{signed_sum()}, COUNT(value) FROM ({source})"
+        params = [param for name in schemas.values() for param in [name, *params]]
+    if by:
+        sql += f" GROUP BY {order} ORDER BY {order}"
+    return db.execute(sql, params).fetchall()
+
+
+# What summarize() reads from each attached ledger
+ATTACHED_SCHEMA = ('Taxonomy', 'MonthlyTotals', 'TransactionsView')
+
+
+@contextmanager
+def attached(db, paths):
+    """ATTACH other ledger files to db for the duration; yields {schema: ledger name}.
+
+    The files are read as they are: a report never creates or migrates
+    tables, so a ledger this version has not opened yet raises ValueError
+    instead.
+    """
+    outdated = [path for path in paths if not set(ATTACHED_SCHEMA) <= schema_names(path)]
+    if outdated:
+        raise ValueError(f"Not a ledger of this version, open it once to upgrade it: "
+                         f"{', '.join(ledger_name(path) for path in outdated)}")
+    schemas = {}
+    try:
+        for i, path in enumerate(paths):
+            schema = f"ledger{i + 1}"
+            db.execute(f"ATTACH DATABASE ? AS {schema}", (path,))
+            schemas[schema] = ledger_name(path)
+        yield schemas
+    finally:
+        for schema in schemas:
+            db.execute(f"DETACH DATABASE {schema}")
+
+
+def monthly_category_totals(db):
+    """month -> category -> amount, read from MonthlyTotals"""
+    totals = defaultdict(lambda: defaultdict(float))
+    cursor = db.execute("""
+        SELECT m.month, COALESCE(c.name, ''), SUM(m.total) FROM MonthlyTotals m
+        LEFT JOIN Taxonomy c ON c.id = m.category_id
+        WHERE m.month != ''
+        GROUP BY m.month, m.category_id
+    """)
+    for month, category, total in cursor:
+        totals[month][category] = total
+    return totals
+
+
+# Columns of BudgetReport.rows()
+BUDGET_REPORT_COLUMNS = ('category', 'budget', 'actual', 'remaining', 'used_pct', 'trailing_mean', 'forecast')
+
+
+def budget_targets(db):
+    """(category, month) -> budgeted amount; month '' is a category's default"""
+    cursor = db.execute("SELECT c.name, b.month, b.amount FROM Budgets b JOIN Taxonomy c ON c.id = b.category_id")
+    return {(category, month): amount for category, month, amount in cursor}
+
+
+def tune(db):
+    for pragma in CONNECTION_PRAGMAS:
+        db.execute(f"PRAGMA {pragma}")
+
+
+class ConnectionPool:
+    """The connections to one ledger file: a single writer and a few readers.
+
+    The file is switched to WAL, and every connection tuned with
+    CONNECTION_PRAGMAS, so the readers, lent to background queries by
+    reading(), see the last commit while the writer is busy.
+    Every write from any thread goes through the one writer connection,
+    taken with writing(), so writes queue on a lock here instead of
+    contending for SQLite's file lock.
+    """
+
+    def __init__(self, path, readers=POOL_READERS):
+        self.path = path
+        self.max_readers = readers
+        self.writer = connect(path, check_same_thread=False)
+        self.writer.execute("PRAGMA journal_mode=WAL")
+        tune(self.writer)
+        self.write_lock = threading.RLock()
+        self.idle = []
+        self.opened = 0
+        self.available = threading.Condition()
+
+    @contextmanager
+    def writing(self):
+        with self.write_lock:
+            yield self.writer
+
+    @contextmanager
+    def reading(self):
+        """Borrow a read-only connection, waiting while all of them are lent out"""
+        with self.available:
+            while not self.idle and self.opened >= self.max_readers:
+                self.available.wait()
+            if self.idle:
+                db = self.idle.pop()
+            else:
+                db = connect(self.path, check_same_thread=False)
+                db.execute("PRAGMA query_only = ON")
+                tune(db)
+                self.opened += 1
+        try:
+            yield db
+        finally:
+            if db.in_transaction:
+                db.rollback()
+            with self.available:
+                self.idle.append(db)
+                self.available.notify()
+
+    def close(self):
+        with self.available:
+            for db in self.idle:
+                db.close()
+            self.idle = []
+        self.writer.close()
+
+
+class Ledger:
+    """One budget database: its connection pool and the caches its writes keep in step with the table"""
+
+    def __init__(self, path=None):
+        self.path = path or default_db_path()
+        self.name = ledger_name(self.path)
+        self.pool = ConnectionPool(self.path)
+        self.db = self.pool.writer
+        self.fts_enabled = create_schema(self.db)
+        self.vocabulary = ColumnVocabulary(self.db)
+        self.taxonomy = Taxonomy(self.db)
+        self.column_cache = None
+        self._budget_report = None
+        self.uncommitted = 0
+
+    def close(self):
+        self.commit()
+        self.pool.close()
+
+    @timed('ledger.add')
+    def add(self, row, commit=True):
+        """Insert a Transactions tuple, returned with its id; commit=False leaves it for a later commit()"""
+        with self.pool.writing():
+            begin_batch(self.db)
+            cursor = self.db.execute("""
+                INSERT INTO Transactions
+                (date, value, type, supplier, funds, category_id, subcategory_id, subsubcategory_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, tuple(row[:5]) + self.taxonomy.resolve(*row[5:8]))
+            self.uncommitted += 1
+            if commit or self.uncommitted >= MAX_UNCOMMITTED_ADDS:
+                self.commit()
+        row = tuple(row) + (cursor.lastrowid,)
+        self.vocabulary.add(row)
+        if self.column_cache is not None:
+            self.column_cache.append(row)
+        return row
+
+    def commit(self):
+        """Commit the adds held back by add(commit=False), if any"""
+        # Without any it skips the write lock, which an import holds for minutes
+        if not self.uncommitted:
+            return
+        with self.pool.writing():
+            if self.db.in_transaction:
+                self.db.commit()
+            self.uncommitted = 0
+
+    def delete(self, row_id):
+        """Delete a transaction by id; returns the deleted row, or None if there was none"""
+        rows = self.delete_many([row_id])
+        return rows[0] if rows else None
+
+    @timed('ledger.delete')
+    def delete_many(self, ids):
+        """Delete transactions by id in one transaction; returns the rows that existed"""
+        ids = list(ids)
+        rows = []
+        for start in range(0, len(ids), MAX_IN_VALUES):
+            chunk = ids[start:start + MAX_IN_VALUES]
+            rows += self.db.execute(f"SELECT {SELECT_COLUMNS} FROM TransactionsView "
+                                    f"WHERE id IN ({', '.join('?' * len(chunk))})", chunk).fetchall()
+        if not rows:
+            # An empty batch would be what undo reverses next, doing nothing
+            return rows
+        with self.pool.writing(), self.db:
+            begin_batch(self.db)
+            self.db.executemany("DELETE FROM Transactions WHERE id = ?", [(row[ID_INDEX],) for row in rows])
+            self.uncommitted = 0
+        if self.column_cache is not None:
+            self.column_cache.remove(row[ID_INDEX] for row in rows)
+        return rows
+
+    def undo_counts(self):
+        """(rows undo() would remove, rows it would put back), or None when there is nothing to undo"""
+        batch = last_undoable_batch(self.db)
+        return None if batch is None else batch_counts(self.db, batch)
+
+    @timed('ledger.undo')
+    def undo(self):
+        """Reverse the newest add, delete or import; returns (rows removed, rows put back), or None"""
+        batch_rows = "id IN (SELECT id FROM ChangeLog WHERE batch = ? AND op = ?)"
+        with self.pool.writing(), self.db:
+            batch = last_undoable_batch(self.db)
+            if batch is None:
+                return None
+            removed = query_rows(self.db, batch_rows, (batch, 1))
+            undo_batch(self.db, batch)
+            self.uncommitted = 0
+        restored = query_rows(self.db, batch_rows, (batch, -1))
+        for row in restored:
+            self.vocabulary.add(row)
+        if self.column_cache is not None:
+            self.column_cache.remove(row[ID_INDEX] for row in removed)
+            self.column_cache.extend(restored)
+        return removed, restored
+
+    @timed('ledger.columns')
+    def columns(self):
+        """The ColumnarCache of this ledger, loaded on first use; None without numpy"""
+        if self.column_cache is None:
+            try:
+                from columnar import ColumnarCache
+            except ImportError:
+                return None
+            self.column_cache = ColumnarCache.load(self.db)
+        return self.column_cache
+
+    def set_columns(self, cache):
+        """Adopt a ColumnarCache loaded on another connection and catch it up"""
+        self.column_cache = cache
+        self.sync_columns()
+
+    def sync_columns(self):
+        """Add rows inserted through another connection, e.g. a background import, to the columnar cache"""
+        if self.column_cache is not None:
+            self.column_cache.extend(query_rows(self.db, "id > ?", (self.column_cache.last_id,)))
+
+    def filter_clause(self, filters, date_range=None):
+        return build_filter_clause(filters, self.vocabulary, self.fts_enabled, self.taxonomy, date_range)
+
+    @timed('ledger.query')
+    def query(self, where="", params=(), limit=None):
+        return query_rows(self.db, where, params, limit)
+
+    @timed('ledger.total')
+    def total(self, where="", params=()):
+        return query_total(self.db, where, params)
+
+    @timed('ledger.summary')
+    def summary(self, by, where="", params=()):
+        return summarize(self.db, by, where, params, {'main': self.name})
+
+    @timed('ledger.consolidated')
+    def consolidated_summary(self, paths, by, filters=(), date_range=None):
+        """summarize() over this ledger and the other ledger files together, on a pooled reader.
+
+        The search texts are matched by name with LIKE, since vocabulary
+        and taxonomy ids differ between ledgers. Safe to call from any thread.
+        """
+        where, params = build_filter_clause(filters, date_range=date_range)
+        paths = [path for path in paths if os.path.abspath(path) != os.path.abspath(self.path)]
+        with self.pool.reading() as db, attached(db, paths) as schemas:
+            return summarize(db, by, where, params, {'main': self.name, **schemas})
+
+    def monthly_totals(self):
+        return monthly_category_totals(self.db)
+
+    def data_version(self):
+        """Changes whenever the tables may have, through this connection or any other"""
+        return self.db.total_changes, self.db.execute("PRAGMA data_version").fetchone()[0]
+
+    def set_budget(self, category, amount, month=''):
+        """Budget a category for one month ('YYYY-MM') or by default; amount None removes it"""
+        category_id = self.taxonomy.node_id(category)
+        if category_id is None:
+            raise ValueError(f"Unknown category: {category}")
+        with self.pool.writing(), self.db:
+            if amount is None:
+                self.db.execute("DELETE FROM Budgets WHERE category_id = ? AND month = ?", (category_id, month))
+            else:
+                self.db.execute("INSERT OR REPLACE INTO Budgets (category_id, month, amount) VALUES (?, ?, ?)",
+                                (category_id, month, amount))
+
+    @timed('ledger.budget_report')
+    def budget_report(self, window=3, horizon=3):
+        """BudgetReport of the whole history, rebuilt only after the tables changed; needs numpy"""
+        key = (self.data_version(), window, horizon)
+        if self._budget_report is None or self._budget_report[0] != key:
+            try:
+                from budget import BudgetReport
+            except ImportError:
+                raise RuntimeError("The budget report needs numpy (pip install numpy)")
+            report = BudgetReport(self.monthly_totals(), budget_targets(self.db), window, horizon)
+            self._budget_report = (key, report)
+        return self._budget_report[1]
+
+    @timed('ledger.import')
+    def import_csv(self, path, funds=None, progress=None):
+        with self.pool.writing():
+            result = import_csv(self.db, path, funds, progress)
+            self.uncommitted = 0
+        self.vocabulary.clear()
+        self.taxonomy.invalidate()
+        self.sync_columns()
+        return result
+
+    @timed('ledger.export')
+    def export(self, path, where="", params=(), progress=None, cancelled=None):
+        return export_rows(self.db, path, where, params, progress, cancelled)
+
+    def rebuild_totals(self, from_log=False):
+        """Recompute MonthlyTotals from the table, or by replaying ChangeLog"""
+        with self.pool.writing():
+            (replay_change_log if from_log else rebuild_monthly_totals)(self.db.cursor())
+            self.db.commit()
+            self.uncommitted = 0
+
+
+def add_filter_arguments(parser):
+    parser.add_argument('--filter', action='append', default=[], metavar='COLUMN=TEXT',
+                        help=f"only rows whose column contains TEXT; columns: {', '.join(COLUMN_NAMES)}")
+    parser.add_argument('--from', dest='date_from', type=normalize_date, help='first date to include')
+    parser.add_argument('--to', dest='date_to', type=normalize_date, help='last date to include')
+
+
+def parse_filters(parser, args, ledger):
+    """WHERE clause and parameters for the --filter/--from/--to arguments"""
+    return ledger.filter_clause(*filter_arguments(parser, args))
+
+
+def filter_arguments(parser, args):
+    """Search texts by column and date range given by the --filter/--from/--to arguments"""
+    filters = [''] * len(COLUMN_NAMES)
+    for spec in args.filter:
+        column, _, text = spec.partition('=')
+        if column not in COLUMN_NAMES:
+            parser.error(f"unknown column in --filter: {column}")
+        filters[COLUMN_NAMES.index(column)] = text.strip().lower()
+    date_range = None
+    if args.date_from or args.date_to:
+        date_range = (args.date_from or '0000-01-01', args.date_to or '9999-12-31')
+    return filters, date_range
+
+
+def run_command(argv, prog='ledger.py'):
+    """Headless entry point: python ledger.py <command> ..."""
+    parser = argparse.ArgumentParser(prog=prog)
+    parser.add_argument('--db', default=None, help="database file (default: the app's budget.db)")
+    commands = parser.add_subparsers(dest='command', required=True)
+    add_parser = commands.add_parser('add', help='record one transaction')
+    add_parser.add_argument('date', type=normalize_date)
+    add_parser.add_argument('value', type=float)
+    add_parser.add_argument('--type', default='Débito')
+    add_parser.add_argument('--supplier', default='')
+    add_parser.add_argument('--funds', default=None)
+    add_parser.add_argument('--category', default=None)
+    add_parser.add_argument('--subcategory', default=None)
+    add_parser.add_argument('--subsubcategory', default='N/A')
+    delete_parser = commands.add_parser('delete', help='delete transactions by id')
+    delete_parser.add_argument('ids', type=int, nargs='+')
+    query_parser = commands.add_parser('query', help='print matching transactions as CSV')
+    add_filter_arguments(query_parser)
+    query_parser.add_argument('--limit', type=int, default=None)
+    summary_parser = commands.add_parser('summary', help='print signed totals per group')
+    add_filter_arguments(summary_parser)
+    summary_parser.add_argument('--by', default='month,category',
+                                help=f"comma separated keys; one of {', '.join(SUMMARY_KEYS)}")
+    summary_parser.add_argument('--include', action='append', default=[], metavar='DB',
+                                help='another ledger file to consolidate with --db; group them apart with --by ledger')
+    rebuild_parser = commands.add_parser('rebuild-totals', help='recompute the MonthlyTotals summary table')
+    rebuild_parser.add_argument('--from-log', action='store_true', help='replay the change log instead of the table')
+    commands.add_parser('undo', help='reverse the last add, delete or import')
+    import_parser = commands.add_parser('import', help='bulk import a CSV or bank export')
+    import_parser.add_argument('file')
+    import_parser.add_argument('--funds', default=None, help='funds value for rows without one')
+    export_parser = commands.add_parser('export', help='export transactions to .csv or .parquet')
+    export_parser.add_argument('file')
+    add_filter_arguments(export_parser)
+    budget_parser = commands.add_parser('budget', help="set or remove a category's monthly budget")
+    budget_parser.add_argument('category')
+    budget_parser.add_argument('amount', type=float, nargs='?', help='omit to remove the budget')
+    budget_parser.add_argument('--month', type=normalize_month, default=None,
+                               help='YYYY-MM this amount is for (default: every month)')
+    report_parser = commands.add_parser('budget-report', help='print budget, actual and forecast per category')
+    report_parser.add_argument('--month', type=normalize_month, default=None,
+                               help='YYYY-MM to report (default: the last month with transactions)')
+    report_parser.add_argument('--window', type=int, default=3, help='months in the trailing mean')
+    report_parser.add_argument('--horizon', type=int, default=3, help='months forecast past the last one')
+    args = parser.parse_args(argv)
+
+    ledger = Ledger(args.db)
+    try:
+        if args.command == 'add':
+            row = ledger.add((args.date, args.value, args.type, args.supplier, args.funds,
+                              args.category, args.subcategory, args.subsubcategory))
+            print(f"Added transaction {row[ID_INDEX]}")
+        elif args.command == 'delete':
+            rows = ledger.delete_many(args.ids)
+            print(f"Deleted {len(rows)} transactions")
+        elif args.command == 'query':
+            where, params = parse_filters(parser, args, ledger)
+            writer = csv.writer(sys.stdout)
+            writer.writerow(COLUMN_NAMES)
+            writer.writerows(row[:ID_INDEX] for row in ledger.query(where, params, args.limit))
+            print(f"TOTAL: {ledger.total(where, params):.2f}", file=sys.stderr)
+        elif args.command == 'summary':
+            by = [key.strip() for key in args.by.split(',') if key.strip()]
+            if any(key not in SUMMARY_KEYS for key in by):
+                parser.error(f"--by keys must be among: {', '.join(SUMMARY_KEYS)}")
+            missing = [path for path in args.include if not os.path.exists(path)]
+            if missing:
+                parser.error(f"no such ledger: {', '.join(missing)}")
+            if args.include:
+                try:
+                    rows = ledger.consolidated_summary(args.include, by, *filter_arguments(parser, args))
+                except ValueError as e:
+                    parser.error(str(e))
+            else:
+                rows = ledger.summary(by, *parse_filters(parser, args, ledger))
+            writer = csv.writer(sys.stdout)
+            writer.writerow(by + ['total', 'count'])
+            for row in rows:
+                writer.writerow(row[:-2] + (f"{row[-2] or 0:.2f}", row[-1]))
+        elif args.command == 'rebuild-totals':
+            ledger.rebuild_totals(args.from_log)
+            print("Monthly totals rebuilt" + (" from the change log" if args.from_log else ""))
+        elif args.command == 'undo':
+            result = ledger.undo()
+            if result is None:
+                print("Nothing to undo")
+            else:
+                removed, restored = result
+                print(f"Undone: removed {len(removed)} transactions, restored {len(restored)}")
+        elif args.command == 'import':
+            count, rejected, seconds = ledger.import_csv(args.file, args.funds,
+                                                         progress=lambda n: print(f"{n} rows...", end='\r'))
+            rate = count / seconds if seconds > 0 else 0
+            print(f"\nImported {count} rows in {seconds:.2f}s ({rate:.0f} rows/s)")
+            if rejected:
+                print(f"Skipped {len(rejected)} unparseable lines: {rejected[:20]}")
+        elif args.command == 'export':
+            where, params = parse_filters(parser, args, ledger)
+            start = time.perf_counter()
+            try:
+                count = ledger.export(args.file, where, params)
+            except RuntimeError as e:
+                print(e)
+                return 1
+            print(f"Exported {count} rows in {time.perf_counter() - start:.2f}s")
+        elif args.command == 'budget':
+            try:
+                ledger.set_budget(args.category, args.amount, args.month or '')
+            except ValueError as e:
+                parser.error(str(e))
+            month = args.month or 'every month'
+            if args.amount is None:
+                print(f"Removed the {args.category} budget for {month}")
+            else:
+                print(f"Budgeted {args.amount:.2f} for {args.category} in {month}")
+        elif args.command == 'budget-report':
+            if args.window < 1 or args.horizon < 0:
+                parser.error("--window must be at least 1 and --horizon not negative")
+            try:
+                report = ledger.budget_report(args.window, args.horizon)
+            except RuntimeError as e:
+                print(e)
+                return 1
+            month = args.month or (report.months[report.history - 1] if report.history else None)
+            if month not in report.months:
+                parser.error(f"no data or forecast for {month}")
+            writer = csv.writer(sys.stdout)
+            writer.writerow(('month',) + BUDGET_REPORT_COLUMNS)
+            for category, *values in report.rows(month):
+                writer.writerow([month, category] + ['' if value is None else f"{value:.2f}" for value in values])
+    finally:
+        ledger.close()
+    return 0
+
+
+COMMANDS = ('add', 'delete', 'query', 'summary', 'rebuild-totals', 'undo', 'import', 'export', 'budget',
+            'budget-report')
+
+
+if __name__ == '__main__':
+    sys.exit(run_command(sys.argv[1:]))
@@ -1,26 +1,113 @@
+import time
+
+# Taken before anything else is imported so the startup report covers imports
+STARTUP_TIME = time.perf_counter()
+
 import sys
 import os
-import sqlite3
+import json
+import cProfile
+import operator
+import datetime
+import itertools
+import threading
 from PyQt5.QtWidgets import (
     QApplication, QWidget, QLabel, QLineEdit, QComboBox, QPushButton,
-    QVBoxLayout, QHBoxLayout, QTableView, QHeaderView, QScrollArea, QMenu, QInputDialog, QAction  
+    QVBoxLayout, QHBoxLayout, QTableView, QHeaderView, QScrollArea, QMenu, QInputDialog, QAction,
+    QFileDialog, QProgressDialog, QCompleter, QDateEdit, QCheckBox, QTableWidget, QTableWidgetItem, QShortcut,
+    QMessageBox
 )
-from PyQt5.QtCore import Qt, QAbstractTableModel, QVariant, QModelIndex
-from PyQt5.QtGui import QIcon
-from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
-from matplotlib.figure import Figure
-import matplotlib
+from PyQt5.QtCore import (
+    Qt, QAbstractTableModel, QVariant, QModelIndex, QObject, QRunnable, QThreadPool, QTimer, pyqtSignal,
+    QStringListModel, QDate, QEvent
+)
+from PyQt5.QtGui import QIcon, QKeySequence
+from collections import defaultdict, OrderedDict
 
-matplotlib.use('Agg')  # Required for PyInstaller
-import numpy as np
-from collections import defaultdict
+from ledger import (
+    SELECT_COLUMNS, ID_INDEX, COLUMN_NAMES, TAXONOMY_COLUMNS, COMMANDS, Ledger, SupplierIndex, default_db_path,
+    ledger_paths, ledger_name, normalize_date, query_rows, query_total, signed_amount, export_rows, run_command
+)
+from timings import TIMINGS, timed
+
+# Ledgers with more rows than this are shown through the paged model.
+# CONTAS_LAZY=1 forces the paged model on, CONTAS_LAZY=0 forces it off.
+LAZY_ROW_THRESHOLD = 100000
+
+# Delay between the last keystroke in a search box and the query being run
+SEARCH_DEBOUNCE_MS = 250
+
+# Entries submitted within this long of each other are committed together;
+# closing the window, switching ledgers and background reads commit sooner.
+COMMIT_DELAY_MS = 1000
+
+# CONTAS_STARTUP_LOG=path appends each launch's startup milestones to that
+# file as one JSON line, to compare time-to-interactive across releases.
+STARTUP_LOG = os.environ.get('CONTAS_STARTUP_LOG')
+STARTUP_MARKS = []
+STARTUP_REPORTED = False
+
+# CONTAS_DEBUG=1 opens the timings panel (Ctrl+Shift+D) at startup;
+# CONTAS_PROFILE=path runs the whole session under cProfile and saves the
+# stats there on exit, for python -m pstats.
+DEBUG_PANEL = os.environ.get('CONTAS_DEBUG') == '1'
+PROFILE_FILE = os.environ.get('CONTAS_PROFILE')
+
+# Number of most recent months drawn by the chart; CONTAS_CHART_MONTHS=0 draws
+# the whole history.
+CHART_MONTHS = int(os.environ.get('CONTAS_CHART_MONTHS', 24))
+
+# Totals and chart data come from a NumPy copy of the table once it has
+# loaded in the background; CONTAS_COLUMNAR=0 keeps them on SQLite.
+USE_COLUMNAR = os.environ.get('CONTAS_COLUMNAR') != '0'
+
+
+def mark_startup(name):
+    """Record a startup milestone, in seconds since main.py started"""
+    if not STARTUP_REPORTED:
+        STARTUP_MARKS.append((name, time.perf_counter() - STARTUP_TIME))
+
+
+def report_startup():
+    """Print the milestones of the first window; later windows are not startup"""
+    global STARTUP_REPORTED
+    if STARTUP_REPORTED:
+        return
+    STARTUP_REPORTED = True
+    print("Startup: " + ", ".join(f"{name} {seconds * 1000:.0f} ms" for name, seconds in STARTUP_MARKS))
+    if not STARTUP_LOG:
+        return
+    entry = {
+        'time': datetime.datetime.now().isoformat(timespec='seconds'),
+        'frozen': getattr(sys, 'frozen', False),
+        'marks': {name: round(seconds, 4) for name, seconds in STARTUP_MARKS},
+    }
+    try:
+        with open(STARTUP_LOG, 'a', encoding='utf-8') as log:
+            log.write(json.dumps(entry) + "\n")
+    except OSError as e:
+        print(f"Could not write startup log: {e}")
+
+
+def null_safe_key(index):
+    """Sort key on a raw row value that orders None first, as SQLite orders NULL"""
+    return lambda row: (row[index] is not None, row[index])
 
 
 class CustomTableModel(QAbstractTableModel):
+    """Table model over an in-memory list of rows.
+
+    Sorting compares the raw typed values (floats for value, ISO strings
+    for date) rather than the display strings. Column -1 is the default
+    newest-first order by id.
+    """
+
     def __init__(self, data, headers):
         super().__init__()
         self._data = data
         self.headers = headers
+        self.sort_column = -1
+        self.sort_order = Qt.DescendingOrder
 
     def rowCount(self, parent=QModelIndex()):
         return len(self._data)
@@ -42,6 +129,816 @@ class CustomTableModel(QAbstractTableModel):
                 return str(section + 1)
         return QVariant()
 
+    def set_rows(self, rows):
+        """Show rows given newest first, in the current sort order"""
+        self.beginResetModel()
+        self._data = rows
+        if self.sort_column >= 0:
+            self._sort_rows()
+        self.endResetModel()
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        self.sort_column = column
+        self.sort_order = order if column >= 0 else Qt.DescendingOrder
+        # A reset rather than a layout change, so no selection outlives the reorder
+        self.beginResetModel()
+        self._sort_rows()
+        self.endResetModel()
+
+    def _sort_key(self):
+        return null_safe_key(ID_INDEX if self.sort_column < 0 else self.sort_column)
+
+    def _sort_rows(self):
+        index = ID_INDEX if self.sort_column < 0 else self.sort_column
+        if any(row[index] is None for row in self._data):
+            key = null_safe_key(index)
+        else:
+            key = operator.itemgetter(index)
+        self._data.sort(key=key, reverse=self.sort_order == Qt.DescendingOrder)
+
+    def add_row(self, row):
+        """Insert a new row where the current sort order puts it"""
+        key = self._sort_key()
+        new_key = key(row)
+        descending = self.sort_order == Qt.DescendingOrder
+        low, high = 0, len(self._data)
+        while low < high:
+            middle = (low + high) // 2
+            other = key(self._data[middle])
+            if (new_key > other) if descending else (new_key < other):
+                high = middle
+            else:
+                low = middle + 1
+        self.beginInsertRows(QModelIndex(), low, low)
+        self._data.insert(low, row)
+        self.endInsertRows()
+
+    def row(self, position):
+        return self._data[position]
+
+    def positions(self, ids):
+        """View positions of the rows with these ids"""
+        return [position for position, row in enumerate(self._data) if row[ID_INDEX] in ids]
+
+    def remove_rows(self, positions):
+        """Remove rows by position, one beginRemoveRows per contiguous run"""
+        positions = sorted(set(positions), reverse=True)
+        while positions:
+            last = first = positions.pop(0)
+            while positions and positions[0] == first - 1:
+                first = positions.pop(0)
+            self.beginRemoveRows(QModelIndex(), first, last)
+            del self._data[first:last + 1]
+            self.endRemoveRows()
+
+
+class PagedTableModel(QAbstractTableModel):
+    """Table model that pages rows in from SQLite by keyset pagination, keeping only the recently used pages"""
+
+    def __init__(self, db, headers, page_size=500, max_pages=20, cache_size=5000):
+        super().__init__()
+        self.db = db
+        self.headers = headers
+        self.page_size = page_size
+        self.max_pages = max_pages
+        self.cache_size = cache_size
+        self.where = ""
+        self.params = []
+        self.sort_column = -1
+        self.sort_order = Qt.DescendingOrder
+        # Taxonomy ids in sort order, None for the rows without one, and each one's position
+        self._runs = []
+        self._run_index = {}
+        self._clear()
+
+    def _clear(self):
+        self._pages = OrderedDict()
+        self._page_bounds = []
+        self._display = OrderedDict()
+        self._row_count = 0
+        self._exhausted = False
+
+    def taxonomy_sort(self):
+        """The Transactions id column behind the sorted column if it is a taxonomy one, else None"""
+        if self.sort_column < 0 or COLUMN_NAMES[self.sort_column] not in TAXONOMY_COLUMNS:
+            return None
+        return f"{COLUMN_NAMES[self.sort_column]}_id"
+
+    def order_by(self):
+        if self.sort_column < 0:
+            return "id DESC"
+        direction = "ASC" if self.sort_order == Qt.AscendingOrder else "DESC"
+        column = COLUMN_NAMES[self.sort_column]
+        if self.taxonomy_sort():
+            return f"{column} {direction}, {column}_id {direction}, id {direction}"
+        return f"{column} {direction}, id {direction}"
+
+    def _select(self, clauses, params, limit, order=None):
+        clauses = ([self.where] if self.where else []) + clauses
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        cursor = self.db.cursor()
+        cursor.execute(f"SELECT {SELECT_COLUMNS} FROM TransactionsView {where} "
+                       f"ORDER BY {order or self.order_by()} LIMIT ?",
+                       list(self.params) + params + [limit])
+        return cursor.fetchall()
+
+    def _read_taxonomy_page(self, column, bound):
+        # No index orders the joined names, so each taxonomy node is read as
+        # its own run, in name order, off the node's id index. Bounds are the
+        # (taxonomy id, id) of the last row of the previous page.
+        ascending = self.sort_order == Qt.AscendingOrder
+        order = "id ASC" if ascending else "id DESC"
+        start = 0 if bound is None else self._run_index.get(bound[0], len(self._runs))
+        rows = []
+        for run in range(start, len(self._runs)):
+            node_id = self._runs[run]
+            clauses, params = ([f"{column} IS NULL"], []) if node_id is None else ([f"{column} = ?"], [node_id])
+            if bound is not None and run == start:
+                clauses.append(f"id {'>' if ascending else '<'} ?")
+                params.append(bound[1])
+            rows += self._select(clauses, params, self.page_size - len(rows), order)
+            if len(rows) >= self.page_size:
+                break
+        return rows
+
+    def _read_page(self, page):
+        # Bounds are the (sort value, id) of the last row of the previous page
+        bound = self._page_bounds[page]
+        taxonomy_column = self.taxonomy_sort()
+        if taxonomy_column:
+            return self._read_taxonomy_page(taxonomy_column, bound)
+        if self.sort_column < 0:
+            if bound is None:
+                return self._select([], [], self.page_size)
+            return self._select(["id < ?"], [bound[1]], self.page_size)
+        column = COLUMN_NAMES[self.sort_column]
+        op = '>' if self.sort_order == Qt.AscendingOrder else '<'
+        # Row values cannot compare NULLs, so those are read as a run of their own
+        runs = ['null', 'value'] if self.sort_order == Qt.AscendingOrder else ['value', 'null']
+        if bound is not None:
+            runs = runs[runs.index('null' if bound[0] is None else 'value'):]
+        rows = []
+        for run in runs:
+            if run == 'null':
+                clauses, params = [f"{column} IS NULL"], []
+                if bound is not None and bound[0] is None:
+                    clauses.append(f"id {op} ?")
+                    params.append(bound[1])
+            else:
+                clauses, params = [f"{column} IS NOT NULL"], []
+                if bound is not None and bound[0] is not None:
+                    clauses.append(f"({column}, id) {op} (?, ?)")
+                    params.extend(bound)
+            rows += self._select(clauses, params, self.page_size - len(rows))
+            if len(rows) >= self.page_size:
+                break
+        return rows
+
+    def _store_page(self, page, rows):
+        self._pages[page] = rows
+        self._pages.move_to_end(page)
+        while len(self._pages) > self.max_pages:
+            self._pages.popitem(last=False)
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return self._row_count
+
+    def columnCount(self, parent=QModelIndex()):
+        return len(self.headers)
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and not self._exhausted
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid() or self._exhausted:
+            return
+        page = len(self._page_bounds)
+        if page == 0:
+            self._page_bounds.append(None)
+        else:
+            last = self.row(self._row_count - 1)
+            taxonomy_column = self.taxonomy_sort()
+            if taxonomy_column:
+                # Rows carry the name, not the node, so the bound looks it up by primary key
+                node_id = self.db.execute(f"SELECT {taxonomy_column} FROM Transactions WHERE id = ?",
+                                          (last[ID_INDEX],)).fetchone()[0]
+                self._page_bounds.append((node_id, last[ID_INDEX]))
+            else:
+                self._page_bounds.append((last[self.sort_column] if self.sort_column >= 0 else None,
+                                          last[ID_INDEX]))
+        rows = self._read_page(page)
+        if len(rows) < self.page_size:
+            self._exhausted = True
+        if not rows:
+            self._page_bounds.pop()
+            return
+        self.beginInsertRows(QModelIndex(), self._row_count, self._row_count + len(rows) - 1)
+        self._store_page(page, rows)
+        self._row_count += len(rows)
+        self.endInsertRows()
+
+    def row(self, position):
+        page = position // self.page_size
+        rows = self._pages.get(page)
+        if rows is None:
+            rows = self._read_page(page)
+            self._store_page(page, rows)
+        else:
+            self._pages.move_to_end(page)
+        return rows[position % self.page_size]
+
+    def data(self, index, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole:
+            position = index.row()
+            cells = self._display.get(position)
+            if cells is None:
+                cells = tuple(str(value) for value in self.row(position)[:len(self.headers)])
+                self._display[position] = cells
+                if len(self._display) > self.cache_size:
+                    self._display.popitem(last=False)
+            else:
+                self._display.move_to_end(position)
+            return cells[index.column()]
+        return QVariant()
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole:
+            if orientation == Qt.Horizontal:
+                return str(self.headers[section])
+            if orientation == Qt.Vertical:
+                return str(section + 1)
+        return QVariant()
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        self.sort_column = column
+        self.sort_order = order if column >= 0 else Qt.DescendingOrder
+        self.refresh()
+
+    def set_filter(self, where, params, first_page=None):
+        self.where = where
+        self.params = params
+        self.refresh(first_page)
+
+    def refresh(self, first_page=None):
+        """Drop every cached page and start again from the newest row"""
+        self.beginResetModel()
+        self._clear()
+        if self.taxonomy_sort():
+            # Reread on every refresh, since submits can add taxonomy nodes
+            level = TAXONOMY_COLUMNS.index(COLUMN_NAMES[self.sort_column])
+            self._runs = [None] + [node_id for (node_id,) in self.db.execute(
+                "SELECT id FROM Taxonomy WHERE level = ? ORDER BY name, id", (level,))]
+            if self.sort_order != Qt.AscendingOrder:
+                self._runs.reverse()
+            self._run_index = {node_id: run for run, node_id in enumerate(self._runs)}
+        if first_page is not None:
+            # Page already read by a background query
+            self._page_bounds.append(None)
+            self._store_page(0, first_page)
+            self._row_count = len(first_page)
+            self._exhausted = len(first_page) < self.page_size
+        self.endResetModel()
+        if first_page is None:
+            self.fetchMore()
+
+
+class FilterSignals(QObject):
+    finished = pyqtSignal(int, object, float)
+    failed = pyqtSignal(int, str)
+
+
+class FilterTask(QRunnable):
+    """Runs a search on a pooled read connection off the GUI thread.
+
+    With a limit only the first page is read, for the paged model;
+    otherwise every matching row is returned. A total already worked out
+    from the columnar cache is passed through instead of summed again.
+    cancel() interrupts a query that is still running so a newer search
+    does not wait behind it.
+    """
+
+    def __init__(self, generation, pool, where, params, limit=None, order="id DESC", total=None):
+        super().__init__()
+        self.generation = generation
+        self.pool = pool
+        self.where = where
+        self.params = params
+        self.limit = limit
+        self.order = order
+        self.total = total
+        self.signals = FilterSignals()
+        self.cancelled = False
+        # Guards db, so cancel() never interrupts a connection already back in the pool
+        self.lock = threading.Lock()
+        self.db = None
+
+    def cancel(self):
+        with self.lock:
+            self.cancelled = True
+            if self.db is not None:
+                self.db.interrupt()
+
+    @timed('filter_query')
+    def run(self):
+        if self.cancelled:
+            return
+        try:
+            with self.pool.reading() as db:
+                with self.lock:
+                    self.db = db
+                try:
+                    rows = query_rows(db, self.where, self.params, self.limit, self.order)
+                    total = self.total if self.total is not None else query_total(db, self.where, self.params)
+                finally:
+                    with self.lock:
+                        self.db = None
+        except Exception as e:
+            if not self.cancelled:
+                self.signals.failed.emit(self.generation, str(e))
+            return
+        if not self.cancelled:
+            self.signals.finished.emit(self.generation, rows, total)
+
+
+class ImportSignals(QObject):
+    finished = pyqtSignal(int, int, float)
+    failed = pyqtSignal(str)
+
+
+class ImportTask(QRunnable):
+    """Runs Ledger.import_csv, on the ledger's writer connection, off the GUI thread"""
+
+    def __init__(self, ledger, path, funds=None):
+        super().__init__()
+        self.ledger = ledger
+        self.path = path
+        self.funds = funds
+        self.signals = ImportSignals()
+
+    def run(self):
+        try:
+            count, rejected, seconds = self.ledger.import_csv(self.path, self.funds)
+        except Exception as e:
+            self.signals.failed.emit(str(e))
+            return
+        self.signals.finished.emit(count, len(rejected), seconds)
+
+
+class UndoTask(QRunnable):
+    """Runs Ledger.undo() off the GUI thread, for undoing a whole import"""
+
+    def __init__(self, ledger):
+        super().__init__()
+        self.ledger = ledger
+        self.signals = ReportSignals()
+
+    def run(self):
+        try:
+            result = self.ledger.undo()
+        except Exception as e:
+            self.signals.failed.emit(str(e))
+            return
+        self.signals.finished.emit(result)
+
+
+class ColumnsSignals(QObject):
+    finished = pyqtSignal(object)
+    failed = pyqtSignal(str)
+
+
+class ColumnsTask(QRunnable):
+    """Loads the columnar cache on a pooled read connection off the GUI thread"""
+
+    def __init__(self, pool):
+        super().__init__()
+        self.pool = pool
+        self.signals = ColumnsSignals()
+        # Set when rows are deleted meanwhile; inserts are caught up afterwards
+        self.stale = False
+
+    @timed('load_columns')
+    def run(self):
+        try:
+            from columnar import ColumnarCache
+            with self.pool.reading() as db:
+                cache = ColumnarCache.load(db)
+        except Exception as e:
+            self.signals.failed.emit(str(e))
+            return
+        self.signals.finished.emit(cache)
+
+
+class SupplierIndexTask(QRunnable):
+    """Builds the supplier completion index on a pooled read connection off the GUI thread"""
+
+    def __init__(self, pool):
+        super().__init__()
+        self.pool = pool
+        self.signals = ReportSignals()
+        # Set when a submit, delete or undo changes the suppliers meanwhile
+        self.stale = False
+
+    @timed('load_supplier_index')
+    def run(self):
+        try:
+            with self.pool.reading() as db:
+                index = SupplierIndex.from_db(db)
+        except Exception as e:
+            self.signals.failed.emit(str(e))
+            return
+        self.signals.finished.emit(index)
+
+
+class ExportSignals(QObject):
+    progress = pyqtSignal(int, int)
+    finished = pyqtSignal(object)
+    failed = pyqtSignal(str)
+
+
+class ExportTask(QRunnable):
+    """Streams the filtered transactions to a file on a pooled read connection"""
+
+    def __init__(self, pool, path, where, params):
+        super().__init__()
+        self.pool = pool
+        self.path = path
+        self.where = where
+        self.params = params
+        self.signals = ExportSignals()
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def run(self):
+        try:
+            with self.pool.reading() as db:
+                count = export_rows(db, self.path, self.where, self.params,
+                                    progress=self.signals.progress.emit, cancelled=lambda: self.cancelled)
+        except Exception as e:
+            self.signals.failed.emit(str(e))
+            return
+        self.signals.finished.emit(count)
+
+
+class ReportSignals(QObject):
+    finished = pyqtSignal(object)
+    failed = pyqtSignal(str)
+
+
+class ReportTask(QRunnable):
+    """Runs a report function, which borrows its own connections, off the GUI thread"""
+
+    def __init__(self, report):
+        super().__init__()
+        self.report = report
+        self.signals = ReportSignals()
+
+    def run(self):
+        try:
+            rows = self.report()
+        except Exception as e:
+            self.signals.failed.emit(str(e))
+            return
+        self.signals.finished.emit(rows)
+
+
+class MonthlyChart:
+    """Receitas vs Despesas bars per month, updated in place.
+
+    Every bar and total label is created once per (month, category) and then
+    only moved or resized. The artists are animated, so while the months,
+    categories and y-axis stay the same a refresh restores the cached
+    background and blits the bars; anything else schedules one draw_idle.
+    matplotlib is imported here rather than at module level, so the window
+    can show before the plotting stack has loaded.
+    """
+    BAR_WIDTH = 0.4
+    MIN_FIG_WIDTH = 6
+    INCH_PER_MONTH = 0.6
+    FIG_HEIGHT = 3
+    BOTTOM_LEGEND = dict(loc='upper center', bbox_to_anchor=(0.5, -0.15), fontsize='x-small', ncol=3, frameon=False)
+    TOP_LEGEND = dict(loc='upper center', bbox_to_anchor=(0.5, 1.05), ncol=3, fancybox=True, shadow=True)
+
+    def __init__(self, colors, window=CHART_MONTHS):
+        import matplotlib
+        matplotlib.use('Agg')  # Required for PyInstaller
+        from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
+        from matplotlib.figure import Figure
+
+        self.canvas = FigureCanvas(Figure(figsize=(self.MIN_FIG_WIDTH, self.FIG_HEIGHT)))
+        self.figure = self.canvas.figure
+        self.ax = self.figure.add_subplot(111)
+        self.colors = colors
+        self.window = window
+        self.legend_options = self.BOTTOM_LEGEND
+        self.months = []
+        self.categories = []
+        self.bars = {}  # (month, category) -> Rectangle; 'Receitas' is the credit bar
+        self.labels = {}  # (month, is_credit) -> Text
+        self.background = None
+        self.ax.set_title("Gráfico Receitas vs Despesas")
+        self.ax.set_xlabel("Data")
+        self.ax.set_ylabel("Soma")
+        self.ax.grid(True, axis='y', linestyle='--', alpha=0.8)
+        self.canvas.mpl_connect('draw_event', self.on_draw)
+
+    def on_draw(self, event):
+        self.background = self.canvas.copy_from_bbox(self.figure.bbox)
+        self.draw_artists()
+
+    def draw_artists(self):
+        for artist in itertools.chain(self.bars.values(), self.labels.values()):
+            self.figure.draw_artist(artist)
+
+    def bar(self, month, category):
+        key = (month, category)
+        if key not in self.bars:
+            from matplotlib.patches import Rectangle
+            rect = Rectangle((0, 0), self.BAR_WIDTH, 0, color=self.colors.get(category, '#CCCCCC'), animated=True)
+            self.bars[key] = self.ax.add_patch(rect)
+        return self.bars[key]
+
+    def label(self, month, is_credit, x, value):
+        key = (month, is_credit)
+        if value <= 0:
+            if key in self.labels:
+                self.labels.pop(key).remove()
+            return
+        if key not in self.labels:
+            self.labels[key] = self.ax.text(0, 0, '', ha='center', va='bottom', fontsize=8,
+                                            color='black', animated=True)
+        text = self.labels[key]
+        text.set_position((x, value + 2))
+        text.set_text(f"{value:.0f}")
+
+    def update(self, monthly_data):
+        months = sorted(monthly_data.keys())
+        if self.window:
+            months = months[-self.window:]
+        categories = sorted({cat for month in months for cat, value in monthly_data[month].items()
+                             if value > 0 and cat != 'Receitas'})
+        visible = set(months)
+        for key in [key for key in self.bars if key[0] not in visible]:
+            self.bars.pop(key).remove()
+        for key in [key for key in self.labels if key[0] not in visible]:
+            self.labels.pop(key).remove()
+
+        highest = 0
+        for i, month in enumerate(months):
+            totals = monthly_data[month]
+            receitas = totals.get('Receitas', 0)
+            rect = self.bar(month, 'Receitas')
+            rect.set_x(i - self.BAR_WIDTH)
+            rect.set_height(receitas)
+            self.label(month, True, i - self.BAR_WIDTH / 2, receitas)
+
+            bottom = 0
+            for cat in categories:
+                value = totals.get(cat, 0)
+                if value <= 0:
+                    if (month, cat) in self.bars:
+                        self.bars.pop((month, cat)).remove()
+                    continue
+                rect = self.bar(month, cat)
+                rect.set_x(i)
+                rect.set_y(bottom)
+                rect.set_height(value)
+                bottom += value
+            self.label(month, False, i + self.BAR_WIDTH / 2, bottom)
+            highest = max(highest, receitas, bottom)
+        # Categories with nothing left in any visible month are not in the loop above
+        for key in [key for key in self.bars if key[1] != 'Receitas' and key[1] not in categories]:
+            self.bars.pop(key).remove()
+
+        layout_changed = months != self.months or categories != self.categories
+        if layout_changed:
+            if len(months) != len(self.months):
+                self.resize(len(months))
+            self.ax.set_xticks(range(len(months)))
+            self.ax.set_xticklabels(months, rotation=20)
+            self.ax.set_xlim(-0.5 - self.BAR_WIDTH / 2, len(months) - 0.5 + self.BAR_WIDTH / 2)
+            self.months = months
+            self.categories = categories
+            self.show_legend()
+        # Headroom only grows, or shrinks once the bars use under half of it
+        top = self.ax.get_ylim()[1]
+        if highest * 1.2 > top or highest * 2.4 < top:
+            self.ax.set_ylim(0, highest * 1.2 or 1)
+            layout_changed = True
+        self.refresh(layout_changed)
+
+    def resize(self, month_count):
+        fig_width = max(self.MIN_FIG_WIDTH, self.INCH_PER_MONTH * month_count)
+        self.figure.set_size_inches(fig_width, self.FIG_HEIGHT)
+        dpi = self.figure.get_dpi()
+        self.canvas.resize(int(fig_width * dpi), int(self.FIG_HEIGHT * dpi))
+
+    def show_legend(self, options=None):
+        if options is not None:
+            self.legend_options = options or None
+        legend = self.ax.get_legend()
+        if legend:
+            legend.remove()
+        if self.legend_options:
+            from matplotlib.patches import Patch
+            handles = [Patch(color=self.colors.get(cat, '#CCCCCC'), label=cat)
+                       for cat in ['Receitas'] + self.categories]
+            self.ax.legend(handles=handles, **self.legend_options)
+
+    def refresh(self, full=False):
+        if full or self.background is None:
+            self.canvas.draw_idle()
+            return
+        self.canvas.restore_region(self.background)
+        self.draw_artists()
+        self.canvas.blit(self.figure.bbox)
+
+
+class TimingsPanel(QWidget):
+    """Live view of the TIMINGS histograms, refreshed every second"""
+    COLUMNS = ('span', 'count', 'mean_ms', 'p50_ms', 'p95_ms', 'max_ms', 'total_ms')
+
+    def __init__(self):
+        super().__init__()
+        self.setWindowTitle('Tempos')
+        self.table = QTableWidget(0, len(self.COLUMNS))
+        self.table.setHorizontalHeaderLabels(self.COLUMNS)
+        header = self.table.horizontalHeader()
+        header.setSectionResizeMode(QHeaderView.ResizeToContents)
+        header.setSectionResizeMode(0, QHeaderView.Stretch)
+        self.table.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.btn_save = QPushButton('Guardar...')
+        self.btn_save.clicked.connect(self.save)
+        self.btn_clear = QPushButton('Limpar')
+        self.btn_clear.clicked.connect(self.clear)
+
+        buttons = QHBoxLayout()
+        buttons.addWidget(self.btn_save)
+        buttons.addWidget(self.btn_clear)
+        buttons.addStretch()
+        layout = QVBoxLayout()
+        layout.addWidget(self.table)
+        layout.addLayout(buttons)
+        self.setLayout(layout)
+        self.resize(1000, 400)
+
+        self.timer = QTimer(self)
+        self.timer.setInterval(1000)
+        self.timer.timeout.connect(self.refresh)
+
+    def showEvent(self, event):
+        self.refresh()
+        self.timer.start()
+        super().showEvent(event)
+
+    def hideEvent(self, event):
+        self.timer.stop()
+        super().hideEvent(event)
+
+    def refresh(self):
+        snapshot = TIMINGS.snapshot()
+        self.table.setRowCount(len(snapshot))
+        for row, (name, summary) in enumerate(snapshot):
+            values = [name] + [summary[column] for column in self.COLUMNS[1:]]
+            for column, value in enumerate(values):
+                text = f"{value:.2f}" if isinstance(value, float) else str(value)
+                self.table.setItem(row, column, QTableWidgetItem(text))
+
+    def save(self):
+        path, _ = QFileDialog.getSaveFileName(self, "Guardar tempos", "tempos.json", "JSON (*.json)")
+        if path:
+            TIMINGS.dump(path)
+
+    def clear(self):
+        TIMINGS.reset()
+        self.refresh()
+
+
+class ReportWindow(QWidget):
+    """A read-only table of report rows in its own window"""
+
+    def __init__(self, title, headers, rows):
+        super().__init__()
+        self.setWindowTitle(title)
+        self.table = QTableWidget(len(rows), len(headers))
+        self.table.setHorizontalHeaderLabels(headers)
+        header = self.table.horizontalHeader()
+        header.setSectionResizeMode(QHeaderView.ResizeToContents)
+        header.setSectionResizeMode(0, QHeaderView.Stretch)
+        self.table.setEditTriggers(QTableWidget.NoEditTriggers)
+        for row, values in enumerate(rows):
+            for column, value in enumerate(values):
+                text = f"{value:.2f}" if isinstance(value, float) else '' if value is None else str(value)
+                item = QTableWidgetItem(text)
+                if isinstance(value, (int, float)):
+                    item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+                self.table.setItem(row, column, item)
+        layout = QVBoxLayout()
+        layout.addWidget(self.table)
+        self.setLayout(layout)
+        self.resize(800, 500)
+
+
+class BudgetWindow(QWidget):
+    """Budget against actual and forecast per category for one month; the budget column is editable"""
+
+    HEADERS = ['categoria', 'orçamento', 'real', 'restante', '% usado', 'média 3 meses', 'previsão']
+
+    def __init__(self, ledger):
+        super().__init__()
+        self.ledger = ledger
+        self.report = None
+        self.cmb_month = QComboBox()
+        self.cmb_month.currentIndexChanged.connect(lambda index: self.show_month())
+        self.chk_month_only = QCheckBox("Só este mês")
+        self.table = QTableWidget(0, len(self.HEADERS))
+        self.table.setHorizontalHeaderLabels(self.HEADERS)
+        header = self.table.horizontalHeader()
+        header.setSectionResizeMode(QHeaderView.ResizeToContents)
+        header.setSectionResizeMode(0, QHeaderView.Stretch)
+        self.table.itemChanged.connect(self.budget_edited)
+        self.lbl_message = QLabel('')
+        month_layout = QHBoxLayout()
+        month_layout.addWidget(QLabel('Mês:'))
+        month_layout.addWidget(self.cmb_month)
+        month_layout.addWidget(self.chk_month_only)
+        month_layout.addStretch()
+        layout = QVBoxLayout()
+        layout.addLayout(month_layout)
+        layout.addWidget(self.table)
+        layout.addWidget(self.lbl_message)
+        self.setLayout(layout)
+        self.resize(800, 500)
+        self.set_ledger(ledger)
+
+    def set_ledger(self, ledger):
+        self.ledger = ledger
+        self.setWindowTitle(f"Orçamento - {ledger.name}")
+        self.cmb_month.blockSignals(True)
+        self.cmb_month.clear()
+        self.cmb_month.blockSignals(False)
+        self.refresh()
+
+    def changeEvent(self, event):
+        # Coming back to the window picks up transactions entered meanwhile;
+        # the ledger keeps the report until the tables change, so this is cheap
+        super().changeEvent(event)
+        if event.type() == QEvent.ActivationChange and self.isActiveWindow() and self.isEnabled():
+            self.refresh()
+
+    def refresh(self):
+        try:
+            self.report = self.ledger.budget_report()
+        except RuntimeError as e:
+            self.lbl_message.setText(str(e))
+            return
+        current = self.cmb_month.currentText()
+        months = self.report.months
+        if [self.cmb_month.itemText(i) for i in range(self.cmb_month.count())] != months:
+            self.cmb_month.blockSignals(True)
+            self.cmb_month.clear()
+            self.cmb_month.addItems(months)
+            if current not in months and self.report.history:
+                current = months[self.report.history - 1]
+            self.cmb_month.setCurrentIndex(months.index(current) if current in months else -1)
+            self.cmb_month.blockSignals(False)
+        self.show_month()
+
+    def show_month(self):
+        rows = self.report.rows(self.cmb_month.currentText()) if self.report else []
+        self.table.blockSignals(True)
+        self.table.setRowCount(len(rows))
+        for row, values in enumerate(rows):
+            for column, value in enumerate(values):
+                text = f"{value:.2f}" if isinstance(value, float) else '' if value is None else str(value)
+                item = QTableWidgetItem(text)
+                if column:
+                    item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+                if column != 1 or values[0] == 'Total' and row == len(rows) - 1:
+                    item.setFlags(item.flags() & ~Qt.ItemIsEditable)
+                self.table.setItem(row, column, item)
+        self.table.blockSignals(False)
+
+    def budget_edited(self, item):
+        """An emptied budget cell removes the budget"""
+        if item.column() != 1:
+            return
+        category = self.table.item(item.row(), 0).text()
+        text = item.text().strip().replace(',', '.')
+        try:
+            amount = float(text) if text else None
+        except ValueError:
+            self.lbl_message.setText(f"Valor inválido: {item.text()}")
+            self.show_month()
+            return
+        month = self.cmb_month.currentText() if self.chk_month_only.isChecked() else ''
+        self.ledger.set_budget(category, amount, month)
+        self.lbl_message.setText('')
+        self.refresh()
+
 
 class TransactionEntryApp(QWidget):
     def __init__(self):
@@ -49,60 +946,55 @@ class TransactionEntryApp(QWidget):
 
         # Database setup
         self.db_path = self.get_db_path()
-        self.db = self.connect_database()
-        self.initialize_database()
+        # Every ledger opened in this session stays open, caches and all, for switching back
+        self.ledgers = {}
+        self.ledger = self.open_ledger(self.db_path)
+        self.db = self.ledger.db if self.ledger else None
+        self.vocabulary = self.ledger.vocabulary if self.ledger else None
+        self.taxonomy = self.ledger.taxonomy if self.ledger else None
+        # Filled in the background by load_supplier_index
+        self.supplier_index = SupplierIndex()
+        self.supplier_task = None
+        self.lazy = self.use_lazy_model()
 
         # UI setup
-        self.subcategory_map = {
-            'Despesas Gerais': ['Supermercado', 'Refeições Escolares', 'Telecomunicações', 'Vestuário', 'Impostos',
-                                'Banco'],
-            'Deslocação': ['Viatura 1', 'Viatura 2', 'Viatura 3', 'Transportes Públicos'],
-            'Estética': ['Cabeleireiro', 'Depilação', 'Unhas'],
-            'Formação': ['Actividades Extra-curriculares', 'Curos e Workshoops', 'Material Didático/ Equipamentos'],
-            'Habitação': ['Seguros', 'Prestação', 'Impostos', 'Manutenção', 'Energia e Recursos', 'Condominio',
-                          'Melhorias e Manutenção'],
-            'Lazer': ['Restauração e Cafetaria', 'Férias', 'Hobbies', 'Actividades Lúdicas', 'Eventos Festivos'],
-            'Saúde e Bem-estar': ['Consultas e Exames', 'Seguros', 'Farmácia', 'Equipamentos', 'Ginásio', 'Saúde Oral'],
-            'Receitas': ['Ordenado', 'Comissões', 'Seguros', 'Aplicações Bancárias', 'Actividades Extra-profissionais']
-        }
-
-        self.subsubcategory_map = {
-            'Viatura 1': ['Combustível', 'Seguro', 'Inspecção', 'Manutenção', 'Portagens', 'Impostos',
-                                  'Multas', 'Estacionamento', 'Outra'],
-            'Viatura 2': ['Combustível', 'Seguro', 'Inspecção', 'Manutenção', 'Portagens', 'Impostos',
-                                   'Multas', 'Estacionamento', 'Outra'],
-            'Viatura 3': ['Combustível', 'Seguro', 'Inspecção', 'Manutenção', 'Portagens', 'Impostos',
-                                   'Multas', 'Estacionamento', 'Outra'],
-            'Transportes Públicos': ['Autocarro', 'Comboio', 'Taxi/Uber', 'Metro', 'Barco', 'Outra'],
-            'Outra': []
-        }
-        
-        self.subsubcategory_map.update({
-            'Seguros': ['Quarteira', 'Sobral'],
-            'Prestação': ['Quarteira', 'Sobral'],
-            'Impostos': ['Quarteira', 'Sobral'],
-            'Manutenção': ['Quarteira', 'Sobral'],
-            'Energia e Recursos': ['Quarteira', 'Sobral'],
-            'Condominio': ['Quarteira', 'Sobral'],
-            'Melhorias e Manutenção': ['Quarteira', 'Sobral'],
-        })
-        
-
         self.headers = ['data', 'valor', 'tipo', 'fornecedor', 'fundos', 'categoria', 'subcategoria', 'subsubcategoria']
         self.full_data = []
-
+        self.monthly_data = defaultdict(lambda: defaultdict(float))
+        self.total = 0.0
+        self.filter_generation = 0
+        self.filter_task = None
+        self.filter_where = ("", [])
+        self.columns = None
+        self.columns_task = None
+        self.importing = False
+        self.report_window = None
+        self.budget_window = None
+
+        mark_startup('database')
         self.init_ui()
+        mark_startup('window')
         self.load_data()
+        mark_startup('data')
+        # Runs from the event loop, after the window's first paint
+        QTimer.singleShot(0, self.build_chart)
+        self.load_columns()
+        self.load_supplier_index()
+
+        self.timings_panel = None
+        QShortcut(QKeySequence('Ctrl+Shift+D'), self, self.toggle_timings_panel)
+        QShortcut(QKeySequence.Undo, self, self.undo_last)
+        if DEBUG_PANEL:
+            self.toggle_timings_panel()
+
+    def toggle_timings_panel(self):
+        if self.timings_panel is None:
+            self.timings_panel = TimingsPanel()
+        self.timings_panel.setVisible(not self.timings_panel.isVisible())
 
     def get_db_path(self):
         """Get the correct database path for both development and executable"""
-        if getattr(sys, 'frozen', False):
-            # Use a safe, writable directory in user profile
-            appdata_dir = os.path.join(os.path.expanduser("~"), ".budget_app")
-            os.makedirs(appdata_dir, exist_ok=True)
-            return os.path.join(appdata_dir, "budget.db")
-        else:
-            return "budget.db"
+        return default_db_path()
             
     def handle_type_change(self, text):
         if text == "Crédito":
@@ -113,45 +1005,132 @@ class TransactionEntryApp(QWidget):
             self.cmb_category.setDisabled(False)
 
 
-    def connect_database(self):
-        """Connect to SQLite database"""
+    def open_ledger(self, path):
+        """Connect to a ledger file and create or migrate its tables"""
+        path = os.path.abspath(path)
+        if path in self.ledgers:
+            return self.ledgers[path]
         try:
-            db = sqlite3.connect(self.db_path)
-            print(f"Connected to database at: {self.db_path}")
-            return db
+            ledger = Ledger(path)
+            print(f"Connected to database at: {path}")
         except Exception as e:
             print(f"Database connection failed: {e}")
             return None
-
-    def initialize_database(self):
-        """Create the table if it doesn't exist"""
-        if self.db is not None:
-            try:
-                cursor = self.db.cursor()
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS Transactions (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        date TEXT,
-                        value REAL,
-                        type TEXT,
-                        supplier TEXT,
-                        funds TEXT,
-                        category TEXT,
-                        subcategory TEXT,
-                        subsubcategory TEXT
-                    )
-                ''')
-                self.db.commit()
-                print("Database table initialized")
-            except Exception as e:
-                print(f"Error initializing database: {e}")
+        self.ledgers[path] = ledger
+        return ledger
+
+    def ledger_choices(self):
+        """Ledger files offered by the switcher: those beside the current one, and any opened elsewhere"""
+        directory = os.path.dirname(os.path.abspath(self.db_path))
+        return sorted(set(ledger_paths(directory)) | set(self.ledgers) | {os.path.abspath(self.db_path)})
+
+    def update_ledger_items(self):
+        self.cmb_ledger.blockSignals(True)
+        self.cmb_ledger.clear()
+        for path in self.ledger_choices():
+            self.cmb_ledger.addItem(ledger_name(path), path)
+        self.cmb_ledger.addItem("Novo livro...", None)
+        self.cmb_ledger.setCurrentIndex(self.cmb_ledger.findData(os.path.abspath(self.db_path)))
+        self.cmb_ledger.blockSignals(False)
+
+    def handle_ledger_change(self, index):
+        path = self.cmb_ledger.itemData(index)
+        if path is None:
+            name, ok = QInputDialog.getText(self, 'Novo livro', 'Nome do novo livro de contas:')
+            name = name.strip()
+            if ok and name:
+                path = os.path.join(os.path.dirname(os.path.abspath(self.db_path)), f"{name}.db")
+        if path is None or path == os.path.abspath(self.db_path):
+            self.update_ledger_items()
+            return
+        self.switch_ledger(path)
+
+    @timed('switch_ledger')
+    def switch_ledger(self, path):
+        """Show another ledger file; the one left stays open in self.ledgers"""
+        self.commit_entries()
+        ledger = self.open_ledger(path)
+        if ledger is None:
+            self.lbl_message.setText(f"Não foi possível abrir {path}")
+            self.update_ledger_items()
+            return
+        # Results still on their way for the previous ledger are dropped
+        self.filter_generation += 1
+        if self.filter_task is not None:
+            self.filter_task.cancel()
+            self.filter_task = None
+        self.columns_task = None
+        self.db_path = ledger.path
+        self.ledger = ledger
+        self.db = ledger.db
+        self.vocabulary = ledger.vocabulary
+        self.taxonomy = ledger.taxonomy
+        self.load_supplier_index()
+        self.columns = ledger.column_cache
+        self.lazy = self.use_lazy_model()
+        self.model = self.create_model()
+        self.table_view.setModel(self.model)
+        self.table_view.horizontalHeader().setSortIndicator(-1, Qt.DescendingOrder)
+        self.full_data = []
+        self.cmb_category.clear()
+        self.cmb_category.addItems(self.taxonomy.children())
+        self.update_ledger_items()
+        if self.budget_window is not None:
+            self.budget_window.set_ledger(ledger)
+        self.lbl_message.setText(f"Livro: {ledger.name}")
+        self.load_data()
+        if self.columns is None:
+            self.load_columns()
+
+    def show_consolidated(self):
+        """Month x ledger totals of every ledger file, for the current search and period"""
+        paths = self.ledger_choices()
+        filters, date_range = self.current_filters(), self.current_date_range()
+        task = ReportTask(lambda: self.ledger.consolidated_summary(paths, ('month', 'ledger'), filters, date_range))
+        task.signals.finished.connect(lambda rows: self.consolidated_finished([ledger_name(p) for p in paths], rows))
+        task.signals.failed.connect(lambda message: self.lbl_message.setText(f"Error in report: {message}"))
+        self.lbl_message.setText("A consolidar...")
+        self.start_task(task)
+
+    def consolidated_finished(self, names, rows):
+        totals = defaultdict(dict)
+        for month, ledger, total, count in rows:
+            totals[month][ledger] = total or 0.0
+        table = [[month or ''] + [totals[month].get(name, 0.0) for name in names] + [sum(totals[month].values())]
+                 for month in sorted(totals, key=lambda month: month or '')]
+        table.append(['Total'] + [sum(row[i + 1] for row in table) for i in range(len(names) + 1)])
+        self.report_window = ReportWindow('Consolidado', ['mês'] + names + ['total'], table)
+        self.report_window.show()
+        self.lbl_message.setText('')
+
+    def show_budget(self):
+        if self.budget_window is None:
+            self.budget_window = BudgetWindow(self.ledger)
+        else:
+            self.budget_window.refresh()
+        self.budget_window.show()
+        self.budget_window.raise_()
+
+    def use_lazy_model(self):
+        """Decide whether the table should page rows from SQLite"""
+        forced = os.environ.get('CONTAS_LAZY')
+        if forced is not None:
+            return forced == '1'
+        if self.db is None:
+            return False
+        try:
+            # MAX(id) is an O(1) upper bound on the row count
+            row = self.db.execute("SELECT MAX(id) FROM Transactions").fetchone()
+            return (row[0] or 0) > LAZY_ROW_THRESHOLD
+        except Exception:
+            return False
 
     def init_ui(self):
         self.setWindowIcon(QIcon("lili.ico"))
 
         # Inputs
         self.le_date = QLineEdit()
-        self.le_date.setPlaceholderText("ex: 2505")
+        self.le_date.setPlaceholderText("ex: 2505 ou 2025-05-31")
         self.le_value = QLineEdit()
         self.le_value.setPlaceholderText("valor sem a anotação do €")
         self.cmb_type = QComboBox()
@@ -159,12 +1138,21 @@ class TransactionEntryApp(QWidget):
         self.cmb_type.currentTextChanged.connect(self.handle_type_change)
         self.le_supplier = QLineEdit()
         self.le_supplier.setPlaceholderText("Pingo Doce")
+        # Completions come from the supplier trie, so Qt shows them unfiltered
+        self.supplier_completions = QStringListModel()
+        self.supplier_completer = QCompleter(self.supplier_completions, self)
+        self.supplier_completer.setCompletionMode(QCompleter.UnfilteredPopupCompletion)
+        self.supplier_completer.activated[str].connect(self.apply_supplier_suggestion)
+        self.le_supplier.setCompleter(self.supplier_completer)
+        self.le_supplier.textEdited.connect(self.complete_supplier)
+        self.le_supplier.editingFinished.connect(
+            lambda: self.apply_supplier_suggestion(self.le_supplier.text()))
         self.cmb_funds = QComboBox()
         self.cmb_funds.addItems(
             ['Dinheiro', 'Conta Bancária 1', 'Conta Bancária 2', 'Conta Bancária 3', 'Conta Bancária 4', 'Conta Bancária 5',
              'Other'])
         self.cmb_category = QComboBox()
-        self.cmb_category.addItems(list(self.subcategory_map.keys()))
+        self.cmb_category.addItems(self.taxonomy.children() if self.taxonomy else [])
         self.cmb_category.currentTextChanged.connect(self.update_subcategory_items)
 
         self.cmb_subcategory = QComboBox()
@@ -178,7 +1166,11 @@ class TransactionEntryApp(QWidget):
         font.setBold(True)
         self.btn_submit.setFont(font)
         self.btn_submit.setStyleSheet("background-color: darkcyan;")
-        self.btn_submit.clicked.connect(self.submit_data)
+        # clicked passes a checked flag the timed wrapper would forward
+        self.btn_submit.clicked.connect(lambda: self.submit_data())
+        self.btn_undo = QPushButton('Desfazer')
+        self.btn_undo.setToolTip('Desfaz a última entrada, remoção ou importação (Ctrl+Z)')
+        self.btn_undo.clicked.connect(lambda: self.undo_last())
 
         self.lbl_message = QLabel('')
         self.lbl_message.setAlignment(Qt.AlignCenter)
@@ -187,6 +1179,28 @@ class TransactionEntryApp(QWidget):
         for i, box in enumerate(self.search_boxes):
             box.setPlaceholderText(f'Search {self.headers[i]}')
 
+        # Filter as the user types, once typing pauses
+        self.filter_timer = QTimer(self)
+        self.filter_timer.setSingleShot(True)
+        self.filter_timer.setInterval(SEARCH_DEBOUNCE_MS)
+        self.filter_timer.timeout.connect(self.apply_filter)
+        for box in self.search_boxes:
+            box.textChanged.connect(self.filter_timer.start)
+        self.commit_timer = QTimer(self)
+        self.commit_timer.setSingleShot(True)
+        self.commit_timer.setInterval(COMMIT_DELAY_MS)
+        self.commit_timer.timeout.connect(self.commit_entries)
+
+        self.chk_period = QCheckBox("Período:")
+        self.chk_period.toggled.connect(self.filter_timer.start)
+        today = QDate.currentDate()
+        self.date_from = QDateEdit(QDate(today.year(), today.month(), 1))
+        self.date_to = QDateEdit(today)
+        for picker in (self.date_from, self.date_to):
+            picker.setCalendarPopup(True)
+            picker.setDisplayFormat("yyyy-MM-dd")
+            picker.dateChanged.connect(self.filter_timer.start)
+
         self.btn_search = QPushButton("Procurar")
         self.btn_search.clicked.connect(self.search_data)
         self.btn_reset = QPushButton("Reiniciar")
@@ -197,19 +1211,31 @@ class TransactionEntryApp(QWidget):
         font.setBold(True)
         self.lbl_sum.setFont(font)
 
-        # Graph setup — initialize BEFORE using graph_canvas
-        self.graph_canvas = FigureCanvas(Figure(figsize=(6, 3)))
-        self.ax = self.graph_canvas.figure.add_subplot(111)
-
-        # Set context menu for graph_canvas
-        self.graph_canvas.setContextMenuPolicy(Qt.CustomContextMenu)
-        self.graph_canvas.customContextMenuRequested.connect(self.show_legend_menu)
+        # The chart is built by build_chart once the window has been painted
+        self.chart = None
+        self.graph_canvas = None
         self.legend_visible = False  # track legend state
 
-        self.model = CustomTableModel([], self.headers)
+        self.btn_import = QPushButton("Importar")
+        self.btn_import.clicked.connect(self.import_file)
+        self.btn_export = QPushButton("Exportar")
+        self.btn_export.clicked.connect(self.export_file)
+
+        self.cmb_ledger = QComboBox()
+        self.update_ledger_items()
+        self.cmb_ledger.currentIndexChanged.connect(self.handle_ledger_change)
+        self.btn_consolidated = QPushButton("Consolidado")
+        self.btn_consolidated.clicked.connect(self.show_consolidated)
+        self.btn_budget = QPushButton("Orçamento")
+        self.btn_budget.clicked.connect(self.show_budget)
+
+        self.model = self.create_model()
         self.table_view = QTableView()
         self.table_view.setModel(self.model)
+        # No sort indicator until a header is clicked: rows start newest first
+        self.table_view.horizontalHeader().setSortIndicator(-1, Qt.DescendingOrder)
         self.table_view.setSortingEnabled(True)
+        self.table_view.setSelectionBehavior(QTableView.SelectRows)
         self.table_view.setContextMenuPolicy(Qt.CustomContextMenu)
         self.table_view.customContextMenuRequested.connect(self.show_context_menu)
         header = self.table_view.horizontalHeader()
@@ -218,7 +1244,7 @@ class TransactionEntryApp(QWidget):
 
         # Wrap canvas in scroll area
         self.scroll_area = QScrollArea()
-        self.scroll_area.setWidget(self.graph_canvas)
+        self.scroll_area.setWidget(QLabel("A carregar gráfico...", alignment=Qt.AlignCenter))
         self.scroll_area.setWidgetResizable(True)
         self.scroll_area.setHorizontalScrollBarPolicy(Qt.ScrollBarAsNeeded)
         self.scroll_area.setVerticalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
@@ -239,6 +1265,14 @@ class TransactionEntryApp(QWidget):
         # Layouts
         layout = QVBoxLayout()
 
+        ledger_layout = QHBoxLayout()
+        ledger_layout.addWidget(QLabel('Livro:'))
+        ledger_layout.addWidget(self.cmb_ledger)
+        ledger_layout.addWidget(self.btn_consolidated)
+        ledger_layout.addWidget(self.btn_budget)
+        ledger_layout.addStretch()
+        layout.addLayout(ledger_layout)
+
         entry_layout = QHBoxLayout()
         entry_layout.addWidget(QLabel('Data:'))
         entry_layout.addWidget(self.le_date)
@@ -262,6 +1296,7 @@ class TransactionEntryApp(QWidget):
 
         submit_layout = QHBoxLayout()
         submit_layout.addWidget(self.btn_submit)
+        submit_layout.addWidget(self.btn_undo)
         layout.addLayout(submit_layout)
 
         layout.addWidget(self.lbl_message)
@@ -271,9 +1306,19 @@ class TransactionEntryApp(QWidget):
             search_layout.addWidget(box)
         layout.addLayout(search_layout)
 
+        period_layout = QHBoxLayout()
+        period_layout.addWidget(self.chk_period)
+        period_layout.addWidget(self.date_from)
+        period_layout.addWidget(QLabel('até'))
+        period_layout.addWidget(self.date_to)
+        period_layout.addStretch()
+        layout.addLayout(period_layout)
+
         btn_layout = QHBoxLayout()
         btn_layout.addWidget(self.btn_search)
         btn_layout.addWidget(self.btn_reset)
+        btn_layout.addWidget(self.btn_import)
+        btn_layout.addWidget(self.btn_export)
         btn_layout.addStretch()
         btn_layout.addWidget(self.lbl_sum)
         layout.addLayout(btn_layout)
@@ -287,32 +1332,57 @@ class TransactionEntryApp(QWidget):
         self.show()
 
 
+    def create_model(self):
+        if self.lazy:
+            return PagedTableModel(self.db, self.headers)
+        return CustomTableModel([], self.headers)
+
     def update_subcategory_items(self, category):
         self.cmb_subcategory.clear()
-        if category in self.subcategory_map:
-            items = self.subcategory_map[category] + ['Outra']
+        if self.taxonomy and self.taxonomy.node_id(category) is not None:
+            items = [name for name in self.taxonomy.children(category) if name != 'Outra'] + ['Outra']
             self.cmb_subcategory.addItems(items)
 
     def update_subsubcategory_items(self, subcategory):
         self.cmb_subsubcategory.clear()
-        items = self.subsubcategory_map.get(subcategory, [])
+        items = self.taxonomy.children(self.cmb_category.currentText(), subcategory) if self.taxonomy else []
         self.cmb_subsubcategory.addItems(items if items else ['N/A'])
         
+    def complete_supplier(self, text):
+        self.supplier_completions.setStringList(self.supplier_index.complete(text) if text.strip() else [])
+
+    def apply_supplier_suggestion(self, supplier):
+        """Pre-fill the category combos with what this supplier is usually filed under"""
+        suggestion = self.supplier_index.suggest(supplier)
+        if suggestion is None:
+            return
+        category, subcategory, subsubcategory = suggestion
+        if self.cmb_category.isEnabled():
+            self.cmb_category.setCurrentText(category)
+        if subcategory and subcategory != 'Outra':
+            self.cmb_subcategory.setCurrentText(subcategory)
+        if subsubcategory:
+            self.cmb_subsubcategory.setCurrentText(subsubcategory)
+
     def handle_subcategory_change(self, subcategory):
         if subcategory == 'Outra':
             category = self.cmb_category.currentText()
             text, ok = QInputDialog.getText(self, 'Nova Subcategoria', 'Digite o nome da nova subcategoria:')
             if ok and text.strip():
                 new_sub = text.strip()
-                # Update internal map
-                if category in self.subcategory_map:
-                    self.subcategory_map[category].append(new_sub)
+                # Persist it so it is still offered after a restart
+                category_id = self.taxonomy.node_id(category)
+                if category_id is not None:
+                    with self.ledger.pool.writing():
+                        self.taxonomy.add(category_id, 1, new_sub)
+                        self.db.commit()
                     # Refresh the items
                     self.update_subcategory_items(category)
                     self.cmb_subcategory.setCurrentText(new_sub)
         else:
             self.update_subsubcategory_items(subcategory)
 
+    @timed('submit_data')
     def submit_data(self):
         if not self.db:
             self.lbl_message.setText("No DB connection")
@@ -323,8 +1393,15 @@ class TransactionEntryApp(QWidget):
             self.lbl_message.setText("Invalid value")
             return
 
+        try:
+            date = self.le_date.text().strip()
+            date = normalize_date(date) if date else datetime.date.today().isoformat()
+        except ValueError:
+            self.lbl_message.setText("Invalid date")
+            return
+
         data = (
-            self.le_date.text().strip(),
+            date,
             value,
             self.cmb_type.currentText(),
             self.le_supplier.text().strip(),
@@ -335,169 +1412,480 @@ class TransactionEntryApp(QWidget):
         )
 
         try:
-            cursor = self.db.cursor()
-            cursor.execute("""
-                INSERT INTO Transactions 
-                (date, value, type, supplier, funds, category, subcategory, subsubcategory)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            """, data)
-            self.db.commit()
+            row = self.ledger.add(data, commit=False)
+            self.commit_timer.start()
             self.lbl_message.setText("Transaction submitted.")
             self.le_date.clear()
             self.le_value.clear()
             self.le_supplier.clear()
-            self.load_data()
+            self.add_transaction(row)
         except Exception as e:
             self.lbl_message.setText(f"Error: {e}")
 
+    def commit_entries(self):
+        """Write out the entries submitted since the last commit"""
+        self.commit_timer.stop()
+        if self.ledger is not None:
+            self.ledger.commit()
+
+    def start_task(self, task):
+        # Pooled readers only see committed rows
+        self.commit_entries()
+        QThreadPool.globalInstance().start(task)
+
+    def closeEvent(self, event):
+        self.commit_entries()
+        super().closeEvent(event)
+
+    @timed('undo_last')
+    def undo_last(self):
+        if self.importing:
+            self.lbl_message.setText("Aguarde o fim da importação")
+            return
+        if self.filter_task is not None:
+            # The table is about to be replaced, so what it shows may be gone already
+            self.lbl_message.setText("Aguarde o fim da pesquisa")
+            return
+        try:
+            counts = self.ledger.undo_counts()
+            if counts is not None and counts[0] > 1:
+                # Only an import adds more than one row at once
+                self.undo_import(counts[0])
+                return
+            result = self.ledger.undo()
+        except Exception as e:
+            self.lbl_message.setText(f"Error undoing: {e}")
+            return
+        self.undo_finished(result)
+
+    def undo_import(self, count):
+        answer = QMessageBox.question(self, "Desfazer importação",
+                                      f"Apagar as {count} transações importadas?")
+        if answer != QMessageBox.Yes:
+            return
+        task = UndoTask(self.ledger)
+        task.signals.finished.connect(self.import_undone)
+        task.signals.failed.connect(self.undo_failed)
+        self.set_importing(True)
+        self.lbl_message.setText("A desfazer a importação...")
+        self.start_task(task)
+
+    def undo_finished(self, result):
+        if result is None:
+            self.lbl_message.setText("Nada para desfazer")
+            return
+        removed, restored = result
+        self.undo_transactions(removed, restored)
+        self.lbl_message.setText(f"Desfeito: {len(removed)} removidas, {len(restored)} repostas")
+
+    def import_undone(self, result):
+        """Like import_finished, rebuild the caches in bulk rather than patch them a row at a time"""
+        self.set_importing(False)
+        if result is None:
+            self.lbl_message.setText("Nada para desfazer")
+            return
+        removed, restored = result
+        if not self.lazy:
+            ids = {row[ID_INDEX] for row in removed}
+            self.full_data = sorted([cached for cached in self.full_data if cached[ID_INDEX] not in ids] + restored,
+                                    key=operator.itemgetter(ID_INDEX), reverse=True)
+        if self.columns_task is not None:
+            self.columns_task.stale = True
+        self.load_supplier_index()
+        self.build_aggregates()
+        self.apply_filter()
+        self.plot_graph()
+        self.lbl_message.setText(f"Desfeito: {len(removed)} removidas, {len(restored)} repostas")
+
+    def undo_failed(self, message):
+        self.set_importing(False)
+        self.lbl_message.setText(f"Error undoing: {message}")
+
+    def undo_transactions(self, removed, restored):
+        """Apply the rows an undo removed and put back to the cached data without reloading"""
+        for row in removed:
+            self.supplier_index.remove(row[3], row[5], row[6], row[7])
+        for row in restored:
+            self.supplier_index.add(row[3], row[5], row[6], row[7])
+        if self.supplier_task is not None:
+            self.supplier_task.stale = True
+        # Restored rows keep their old ids, which catching up by id would miss
+        if self.columns_task is not None:
+            self.columns_task.stale = True
+        self.update_aggregates(removed, -1)
+        self.update_aggregates(restored, 1)
+        filters = self.current_filters()
+        shown_removed = [row for row in removed if self.row_matches(row, filters)]
+        shown_restored = [row for row in restored if self.row_matches(row, filters)]
+        if self.lazy:
+            if shown_removed or shown_restored:
+                self.model.refresh()
+        else:
+            ids = {row[ID_INDEX] for row in removed}
+            self.full_data = [cached for cached in self.full_data if cached[ID_INDEX] not in ids]
+            if restored:
+                # Both runs are newest first, so this sort is a single merge
+                self.full_data = sorted(self.full_data + restored, key=operator.itemgetter(ID_INDEX), reverse=True)
+            self.model.remove_rows(self.model.positions(ids))
+            for row in shown_restored:
+                self.model.add_row(row)
+        self.total += sum(signed_amount(row) for row in shown_restored)
+        self.total -= sum(signed_amount(row) for row in shown_removed)
+        self.show_sum()
+        self.plot_graph()
+
+    def add_transaction(self, row):
+        """Apply a newly inserted row to the cached data without reloading"""
+        self.supplier_index.add(row[3], row[5], row[6], row[7])
+        if self.supplier_task is not None:
+            self.supplier_task.stale = True
+        self.update_aggregates([row], 1)
+        if self.filter_task is not None:
+            # A search still in flight may have missed this row, so rerun it
+            if not self.lazy:
+                self.full_data.insert(0, row)
+            self.apply_filter()
+            self.plot_graph()
+            return
+        matches = self.row_matches(row, self.current_filters())
+        if self.lazy:
+            if matches:
+                self.model.refresh()
+        else:
+            # Rows are kept newest first, matching ORDER BY id DESC
+            self.full_data.insert(0, row)
+            if matches:
+                self.model.add_row(row)
+        if matches:
+            self.total += signed_amount(row)
+            self.show_sum()
+        self.plot_graph()
+
+    def remove_transactions(self, rows, positions):
+        """Drop deleted rows, shown at the given view positions, from the cached data without reloading"""
+        ids = {row[ID_INDEX] for row in rows}
+        for row in rows:
+            self.supplier_index.remove(row[3], row[5], row[6], row[7])
+        if self.supplier_task is not None:
+            self.supplier_task.stale = True
+        if self.columns_task is not None:
+            self.columns_task.stale = True
+        self.update_aggregates(rows, -1)
+        if not self.lazy:
+            self.full_data = [cached for cached in self.full_data if cached[ID_INDEX] not in ids]
+        if self.filter_task is not None:
+            self.apply_filter()
+            self.plot_graph()
+            return
+        if self.lazy:
+            self.model.refresh()
+        else:
+            self.model.remove_rows(positions)
+        # Every deleted row was on screen, so it was part of the filtered total
+        self.total -= sum(signed_amount(row) for row in rows)
+        self.show_sum()
+        self.plot_graph()
+
+    @timed('load_data')
     def load_data(self):
         if not self.db:
             self.lbl_message.setText("No database connection")
             return
         try:
-            cursor = self.db.cursor()
-            cursor.execute(
-                "SELECT date, value, type, supplier, funds, category, subcategory, subsubcategory FROM Transactions ORDER BY id DESC")
-            data = cursor.fetchall()
-            self.full_data = [tuple(item) for item in data]
+            self.vocabulary.clear()
+            if not self.lazy:
+                self.full_data = self.ledger.query()
+            self.build_aggregates()
             self.apply_filter()
             self.plot_graph()
         except Exception as e:
             self.lbl_message.setText(f"Error loading data: {str(e)}")
             print(f"Database error: {str(e)}")
 
-    
+    def import_file(self):
+        path, _ = QFileDialog.getOpenFileName(self, "Importar transações", "", "CSV (*.csv *.txt);;Todos (*)")
+        if not path:
+            return
+        task = ImportTask(self.ledger, path, self.cmb_funds.currentText())
+        task.signals.finished.connect(self.import_finished)
+        task.signals.failed.connect(self.import_failed)
+        self.set_importing(True)
+        self.lbl_message.setText("A importar...")
+        self.start_task(task)
+
+    def set_importing(self, importing):
+        """The import holds the ledger's writer, so other writes and switching ledgers wait for it"""
+        self.importing = importing
+        # 'Outra' in cmb_subcategory writes a new taxonomy node
+        for widget in (self.btn_import, self.btn_submit, self.btn_undo, self.cmb_ledger, self.btn_budget,
+                       self.cmb_subcategory):
+            widget.setDisabled(importing)
+        if self.budget_window is not None:
+            self.budget_window.setDisabled(importing)
+
+    def import_finished(self, count, rejected, seconds):
+        self.set_importing(False)
+        rate = count / seconds if seconds > 0 else 0
+        message = f"Importadas {count} transações ({rate:.0f} linhas/s)"
+        if rejected:
+            message += f", {rejected} linhas ignoradas"
+        self.lbl_message.setText(message)
+        lazy = self.use_lazy_model()
+        if lazy != self.lazy:
+            self.lazy = lazy
+            self.model = self.create_model()
+            self.table_view.setModel(self.model)
+        self.full_data = []
+        self.load_supplier_index()
+        self.load_data()
+
+    def import_failed(self, message):
+        self.set_importing(False)
+        self.lbl_message.setText(f"Error importing data: {message}")
+
+    def export_file(self):
+        path, _ = QFileDialog.getSaveFileName(self, "Exportar transações", "transacoes.csv",
+                                              "CSV (*.csv);;Parquet (*.parquet)")
+        if not path:
+            return
+        # Export exactly what the search boxes currently select
+        where, params = self.filter_clause()
+        task = ExportTask(self.ledger.pool, path, where, params)
+        self.export_progress = QProgressDialog("A exportar...", "Cancelar", 0, 100, self)
+        self.export_progress.setWindowModality(Qt.WindowModal)
+        self.export_progress.canceled.connect(task.cancel)
+        task.signals.progress.connect(self.export_progressed)
+        task.signals.finished.connect(self.export_finished)
+        task.signals.failed.connect(self.export_failed)
+        self.btn_export.setDisabled(True)
+        self.start_task(task)
+
+    def export_progressed(self, done, total):
+        self.export_progress.setMaximum(max(total, 1))
+        self.export_progress.setValue(done)
+
+    def export_finished(self, count):
+        self.btn_export.setDisabled(False)
+        self.export_progress.reset()
+        if count is None:
+            self.lbl_message.setText("Exportação cancelada")
+        else:
+            self.lbl_message.setText(f"Exportadas {count} transações")
+
+    def export_failed(self, message):
+        self.btn_export.setDisabled(False)
+        self.export_progress.reset()
+        self.lbl_message.setText(f"Error exporting data: {message}")
+
     def show_context_menu(self, position):
         index = self.table_view.indexAt(position)
         if index.isValid():
+            rows = sorted({selected.row() for selected in self.table_view.selectionModel().selectedRows()})
+            if index.row() not in rows:
+                rows = [index.row()]
             menu = QMenu()
-            delete_action = menu.addAction("Delete Row")
+            delete_action = menu.addAction("Delete Row" if len(rows) == 1 else f"Delete {len(rows)} Rows")
             action = menu.exec_(self.table_view.mapToGlobal(position))
             if action == delete_action:
-                self.delete_row(index.row())
+                self.delete_rows(rows)
 
+    def delete_row(self, position):
+        self.delete_rows([position])
 
-    def delete_row(self, row):
-        id_query = "SELECT id FROM Transactions ORDER BY id DESC LIMIT 1 OFFSET ?"
-        cursor = self.db.cursor()
-        cursor.execute(id_query, (row,))
-        row_id = cursor.fetchone()
-        if row_id:
-            cursor.execute("DELETE FROM Transactions WHERE id=?", (row_id[0],))
-            self.db.commit()
-            self.load_data()
-    
-    
+    @timed('delete_rows')
+    def delete_rows(self, positions):
+        """Delete the transactions shown at the given view rows, by the id each row carries"""
+        if self.importing:
+            self.lbl_message.setText("Aguarde o fim da importação")
+            return
+        if self.filter_task is not None:
+            self.lbl_message.setText("Aguarde o fim da pesquisa")
+            return
+        ids = [self.model.row(position)[ID_INDEX] for position in positions]
+        try:
+            deleted = self.ledger.delete_many(ids)
+        except Exception as e:
+            self.lbl_message.setText(f"Error deleting: {e}")
+            return
+        self.remove_transactions(deleted, positions)
+
+    def current_filters(self):
+        return [box.text().strip().lower() for box in self.search_boxes]
+
+    def current_date_range(self):
+        if not self.chk_period.isChecked():
+            return None
+        return (self.date_from.date().toString(Qt.ISODate), self.date_to.date().toString(Qt.ISODate))
+
+    def filter_clause(self):
+        return self.ledger.filter_clause(self.current_filters(), self.current_date_range())
+
+    def row_matches(self, row, filters):
+        date_range = self.current_date_range()
+        if date_range is not None and not date_range[0] <= (row[0] or '') <= date_range[1]:
+            return False
+        return all(f in str(row[i]).lower() for i, f in enumerate(filters) if f)
+
+    @timed('apply_filter')
     def apply_filter(self):
-        filters = [box.text().strip().lower() for box in self.search_boxes]
-        filtered = [row for row in self.full_data if all(f in str(row[i]).lower() for i, f in enumerate(filters) if f)]
-        self.model._data = filtered
-        self.model.layoutChanged.emit()
-        self.update_sum(filtered)
+        self.filter_timer.stop()
+        self.filter_generation += 1
+        if self.filter_task is not None:
+            self.filter_task.cancel()
+            self.filter_task = None
+        where, params = self.filter_clause()
+        total = self.columns_total()
+        if not where and not self.lazy:
+            self.model.set_rows(list(self.full_data))
+            self.total = total if total is not None else self.ledger.total(where, params)
+            self.show_sum()
+            return
+        if self.lazy:
+            task = FilterTask(self.filter_generation, self.ledger.pool, where, params, self.model.page_size,
+                              self.model.order_by(), total)
+        else:
+            task = FilterTask(self.filter_generation, self.ledger.pool, where, params, total=total)
+        task.signals.finished.connect(self.filter_finished)
+        task.signals.failed.connect(self.filter_failed)
+        self.filter_task = task
+        self.filter_where = (where, params)
+        self.start_task(task)
+
+    @timed('filter_finished')
+    def filter_finished(self, generation, rows, total):
+        # Results of a superseded search are dropped
+        if generation != self.filter_generation:
+            return
+        self.filter_task = None
+        if self.lazy:
+            where, params = self.filter_where
+            self.model.set_filter(where, params, rows)
+        else:
+            self.model.set_rows(rows)
+        self.total = total
+        self.show_sum()
+
+    def filter_failed(self, generation, message):
+        if generation != self.filter_generation:
+            return
+        self.filter_task = None
+        self.lbl_message.setText(f"Error filtering data: {message}")
 
     def search_data(self):
         self.apply_filter()
 
     def reset_search(self):
         for box in self.search_boxes:
+            box.blockSignals(True)
             box.clear()
+            box.blockSignals(False)
+        self.chk_period.blockSignals(True)
+        self.chk_period.setChecked(False)
+        self.chk_period.blockSignals(False)
         self.apply_filter()
 
-    def update_sum(self, data):
-        total = 0
-        for row in data:
-            try:
-                val = float(row[1])
-                ttype = row[2].lower()
-                total += val if ttype == 'credit' else -val
-            except:
-                pass
-        self.lbl_sum.setText(f"TOTAL: {total:.2f}")
+    def show_sum(self):
+        self.lbl_sum.setText(f"TOTAL: {self.total:.2f}")
 
-    def plot_graph(self):
-        monthly_data = defaultdict(lambda: defaultdict(float))
-        for row in self.full_data:
-            try:
-                month = row[0][:7]
-                value = float(row[1])
-                category = row[5]
-                monthly_data[month][category] += value
-            except:
-                continue
-
-        months = sorted(monthly_data.keys())
-        all_categories = set()
-        for month_data in monthly_data.values():
-            all_categories.update(month_data.keys())
-        all_categories.discard('Receitas')
-
-        categories = sorted(all_categories)
-        expenses_data = {cat: [] for cat in categories}
-        receitas_data = []
+    def load_columns(self):
+        if not USE_COLUMNAR or self.ledger is None:
+            return
+        task = ColumnsTask(self.ledger.pool)
+        task.signals.finished.connect(lambda cache: self.columns_loaded(task, cache))
+        task.signals.failed.connect(lambda message: self.columns_failed(task, message))
+        self.columns_task = task
+        self.start_task(task)
+
+    def load_supplier_index(self):
+        """Rebuild the supplier index in the background; completion starts from an empty one meanwhile"""
+        self.supplier_index = SupplierIndex()
+        if self.ledger is None:
+            self.supplier_task = None
+            return
+        task = SupplierIndexTask(self.ledger.pool)
+        task.signals.finished.connect(lambda index: self.supplier_index_loaded(task, index))
+        task.signals.failed.connect(lambda message: self.supplier_index_failed(task, message))
+        self.supplier_task = task
+        self.start_task(task)
+
+    def finish_load(self, name, task, restart):
+        """Clear a finished background load; False if it is dropped, for another ledger or as stale and restarted"""
+        if task is not getattr(self, name):
+            return False
+        setattr(self, name, None)
+        if task.stale:
+            restart()
+            return False
+        return True
+
+    def supplier_index_loaded(self, task, index):
+        if self.finish_load('supplier_task', task, self.load_supplier_index):
+            self.supplier_index = index
+
+    def supplier_index_failed(self, task, message):
+        if task is self.supplier_task:
+            self.supplier_task = None
+            self.lbl_message.setText(f"Error loading suppliers: {message}")
+
+    def columns_loaded(self, task, cache):
+        if self.finish_load('columns_task', task, self.load_columns):
+            self.ledger.set_columns(cache)
+            self.columns = cache
+
+    def columns_failed(self, task, message):
+        # Without numpy everything keeps running on SQLite
+        if task is self.columns_task:
+            self.columns_task = None
+            print(f"Columnar cache unavailable: {message}")
+
+    @timed('columns_total')
+    def columns_total(self):
+        """Total of the rows the search selects from the columnar cache, or None where only SQLite can tell"""
+        if self.columns is None:
+            return None
+        mask = self.columns.mask(self.current_filters(), self.current_date_range(), self.ledger.fts_enabled)
+        return self.columns.total(mask) if mask is not None else None
+
+    @timed('build_aggregates')
+    def build_aggregates(self):
+        """Group the columnar cache by month x category, or read the totals kept by the MonthlyTotals triggers"""
+        if self.columns is not None:
+            self.monthly_data = self.columns.monthly_category_totals()
+        else:
+            self.monthly_data = self.ledger.monthly_totals()
 
-        for month in months:
-            receitas_data.append(monthly_data[month].get('Receitas', 0))
-            for cat in categories:
-                expenses_data[cat].append(monthly_data[month].get(cat, 0))
-
-        self.ax.clear()
-        x = np.arange(len(months))
-        fixed_bar_width = 0.4
-
-        min_fig_width = 6
-        inch_per_month = 0.6
-        fig_width = max(min_fig_width, inch_per_month * len(months))
-        self.graph_canvas.figure.set_size_inches(fig_width, 3)
-        dpi = self.graph_canvas.figure.get_dpi()
-        self.graph_canvas.resize(int(fig_width * dpi), int(3 * dpi))
-
-        # Plot credit (Receitas) bars
-        self.ax.bar(x - fixed_bar_width / 2, receitas_data, fixed_bar_width,
-                    color=self.category_colors.get('Receitas', '#77DA99'), label='Receitas')
-
-        # Plot stacked debit (Despesas) bars
-        bottom = np.zeros(len(months))
-        total_debits = np.zeros(len(months))
-        for cat in categories:
-            values = expenses_data[cat]
-            if sum(values) > 0:
-                self.ax.bar(x + fixed_bar_width / 2, values, fixed_bar_width,
-                            bottom=bottom,
-                            color=self.category_colors.get(cat, '#CCCCCC'),
-                            label=cat)
-                bottom += np.array(values)
-                total_debits += np.array(values)
-
-        self.ax.set_xticks(x)
-        # Add sum labels on top of stacked debits
-        for i, val in enumerate(total_debits):
-            if val > 0:
-                self.ax.text(x[i] + fixed_bar_width / 2, val + 2, f"{val:.0f}",
-                             ha='center', va='bottom', fontsize=8, color='black')
-                             
-        # Add sum labels on top of stacked credits
-        for i, val in enumerate(receitas_data):
-            if val > 0:
-                self.ax.text(x[i] - fixed_bar_width / 2, val + 2, f"{val:.0f}",
-                             ha='center', va='bottom', fontsize=8, color='black')
-
-
-        self.ax.set_xticks(x)
-        self.ax.set_xticklabels(months, rotation=20)
-        self.ax.set_title("Gráfico Receitas vs Despesas")
-        self.ax.set_xlabel("Data")
-        self.ax.set_ylabel("Soma")
-        self.ax.legend(loc='upper center', bbox_to_anchor=(0.5, -0.15),
-               fontsize='x-small', ncol=3, frameon=False)
-        self.ax.grid(True, axis='y', linestyle='--', alpha=0.8)
+    def update_aggregates(self, rows, sign):
+        """Add (sign=1) or take out (sign=-1) rows from the month x category totals in place"""
+        for row in rows:
+            month = (row[0] or '')[:7]
+            if not month or row[1] is None:
+                continue
+            totals = self.monthly_data[month]
+            category = row[5] or ''
+            totals[category] += sign * row[1]
+            if sign < 0 and abs(totals[category]) < 1e-9:
+                del totals[category]
+                if not totals:
+                    del self.monthly_data[month]
+
+    def build_chart(self):
+        """Import matplotlib and draw the chart in place of its placeholder"""
+        mark_startup('first paint')
+        self.chart = MonthlyChart(self.category_colors)
+        self.graph_canvas = self.chart.canvas
+        self.graph_canvas.setContextMenuPolicy(Qt.CustomContextMenu)
+        self.graph_canvas.customContextMenuRequested.connect(self.show_legend_menu)
+        self.scroll_area.setWidget(self.graph_canvas)
+        self.plot_graph()
+        mark_startup('chart')
+        report_startup()
 
-        # Adjust y-axis limit to add headroom
-        max_receita = max(receitas_data) if receitas_data else 0
-        max_debito = max(total_debits) if total_debits.any() else 0
-        self.ax.set_ylim(0, max(max_receita, max_debito) * 1.2)
+    @timed('plot_graph')
+    def plot_graph(self):
+        if self.chart is None:
+            return
+        self.chart.update(self.monthly_data)
 
-        self.graph_canvas.draw()
-        
     def show_legend_menu(self, pos):
         menu = QMenu()
         action_toggle_legend = QAction("Toggle Legend", self)
@@ -506,21 +1894,26 @@ class TransactionEntryApp(QWidget):
         menu.exec_(self.graph_canvas.mapToGlobal(pos))
 
     def toggle_legend(self):
-        # If legend visible, remove it
-        if self.legend_visible:
-            leg = self.ax.get_legend()
-            if leg:
-                leg.remove()
-            self.legend_visible = False
-        else:
-            # Show legend at the top center inside the plot
-            self.ax.legend(loc='upper center', bbox_to_anchor=(0.5, 1.05), ncol=3, fancybox=True, shadow=True)
-            self.legend_visible = True
+        # Hide the legend, or show it at the top center inside the plot
+        self.legend_visible = not self.legend_visible
+        self.chart.show_legend(MonthlyChart.TOP_LEGEND if self.legend_visible else {})
+        self.chart.refresh(full=True)
+
 
-        self.graph_canvas.draw_idle()
+mark_startup('imports')
 
 
 if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] in COMMANDS or sys.argv[1:2] == ['--db']:
+        sys.exit(run_command(sys.argv[1:], prog='main.py'))
+    profiler = cProfile.Profile() if PROFILE_FILE else None
+    if profiler is not None:
+        profiler.enable()
     app = QApplication(sys.argv)
     ex = TransactionEntryApp()
-    sys.exit(app.exec_())
\ No newline at end of file
+    status = app.exec_()
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(PROFILE_FILE)
+        print(f"Profile saved to {PROFILE_FILE}")
+    sys.exit(status)
\ No newline at end of file
@@ -0,0 +1,195 @@
+"""Timing spans and latency histograms for the hot paths.
+
+Functions decorated with timed(name) or code run under TIMINGS.span(name)
+add one sample to the histogram of that name. With CONTAS_TIMINGS=1,
+connections opened through connect() also time every SQL statement and
+its fetches, and count statements run by triggers through the sqlite3
+trace callback. CONTAS_TIMINGS_FILE=path writes everything collected to
+that file as JSON when the process exits.
+"""
+import os
+import re
+import json
+import time
+import atexit
+import bisect
+import datetime
+import functools
+import threading
+import sqlite3
+from collections import Counter
+from contextlib import contextmanager
+
+# CONTAS_TIMINGS=1 times individual SQL statements as well as the named spans
+SQL_TIMINGS = os.environ.get('CONTAS_TIMINGS') == '1'
+TIMINGS_FILE = os.environ.get('CONTAS_TIMINGS_FILE')
+
+# Upper bounds of the histogram buckets, in milliseconds; the last bucket is open
+BUCKET_BOUNDS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+# The trace callback sees statements with their parameters expanded
+LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+
+
+class Histogram:
+    """Count, total, extremes and bucketed distribution of one span's durations"""
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKET_BOUNDS_MS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, seconds):
+        ms = seconds * 1000
+        self.buckets[bisect.bisect_left(BUCKET_BOUNDS_MS, ms)] += 1
+        self.count += 1
+        self.total += ms
+        self.min = ms if self.min is None else min(self.min, ms)
+        self.max = ms if self.max is None else max(self.max, ms)
+
+    def percentile(self, fraction):
+        """Upper bound of the bucket holding the given fraction of samples, capped at the maximum"""
+        wanted = fraction * self.count
+        seen = 0
+        for bound, count in zip(BUCKET_BOUNDS_MS, self.buckets):
+            seen += count
+            if seen >= wanted:
+                return float(min(bound, self.max))
+        return self.max
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'total_ms': round(self.total, 3),
+            'mean_ms': round(self.total / self.count, 3) if self.count else None,
+            'min_ms': self.min,
+            'p50_ms': self.percentile(0.5),
+            'p95_ms': self.percentile(0.95),
+            'max_ms': self.max,
+            'buckets': dict(zip([f"<={bound}" for bound in BUCKET_BOUNDS_MS] + ['>'], self.buckets)),
+        }
+
+
+class Timings:
+    """Histograms by span name, shared by every thread"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.histograms = {}
+            self.statements = Counter()
+
+    def record(self, name, seconds):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.add(seconds)
+
+    @contextmanager
+    def span(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def timed(self, name):
+        def decorate(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.record(name, time.perf_counter() - start)
+            return wrapper
+        return decorate
+
+    def trace(self, statement):
+        """sqlite3 trace callback: counts statements, including those run by triggers"""
+        with self.lock:
+            self.statements[statement_key(LITERALS.sub('?', statement))] += 1
+
+    def snapshot(self):
+        """(name, summary) pairs, the most total time first"""
+        with self.lock:
+            items = [(name, histogram.summary()) for name, histogram in self.histograms.items()]
+        return sorted(items, key=lambda item: item[1]['total_ms'], reverse=True)
+
+    def dump(self, path):
+        with self.lock:
+            statements = self.statements.most_common(100)
+        data = {
+            'created': datetime.datetime.now().isoformat(timespec='seconds'),
+            'spans': dict(self.snapshot()),
+            'statements': dict(statements),
+        }
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
+
+
+TIMINGS = Timings()
+timed = TIMINGS.timed
+
+
+def statement_key(sql):
+    """Short single-line form of a statement, used as its span name"""
+    return 'sql: ' + ' '.join(sql.split())[:80]
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Cursor recording execute and fetch times under the statement's name"""
+
+    key = None
+
+    def execute(self, sql, parameters=()):
+        self.key = statement_key(sql)
+        with TIMINGS.span(self.key):
+            return super().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        self.key = statement_key(sql)
+        with TIMINGS.span(self.key):
+            return super().executemany(sql, seq_of_parameters)
+
+    def fetchone(self):
+        with TIMINGS.span(f"{self.key} [fetch]"):
+            return super().fetchone()
+
+    def fetchmany(self, size=None):
+        with TIMINGS.span(f"{self.key} [fetch]"):
+            return super().fetchmany(size if size is not None else self.arraysize)
+
+    def fetchall(self):
+        with TIMINGS.span(f"{self.key} [fetch]"):
+            return super().fetchall()
+
+
+class TimedConnection(sqlite3.Connection):
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+def connect(path, **kwargs):
+    """sqlite3.connect, with per-statement timing when CONTAS_TIMINGS=1"""
+    if not SQL_TIMINGS:
+        return sqlite3.connect(path, **kwargs)
+    db = sqlite3.connect(path, factory=TimedConnection, **kwargs)
+    db.set_trace_callback(TIMINGS.trace)
+    return db
+
+
+if TIMINGS_FILE:
+    atexit.register(TIMINGS.dump, TIMINGS_FILE)